@@ -0,0 +1,14 @@
+import subprocess
+from pathlib import Path
+
+
+def git_commit():
+    """Short hash of the checked out commit, None outside of a git tree."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True,
+                              text=True,
+                              check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,176 @@
+import time
+import timeit
+
+import numpy as np
+from mne.time_frequency import psd_array_multitaper
+
+from data.create_data import get_band_ratios, get_engagement_workload
+from features.psd import (FMAX, FMIN, compute_multitaper_psd,
+                          compute_welch_psd, get_epoch_windows,
+                          get_multitaper_kernel)
+
+
+def benchmark_band_ratios(config, n_epochs=1000, n_channels=30, repeat=5):
+    """Compare the per-epoch and the batched band ratio computation.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    n_epochs : int
+        Number of epochs of the synthetic PSD.
+    n_channels : int
+        Number of channels of the synthetic PSD.
+    repeat : int
+        Number of timed runs, the best one is reported.
+
+    Returns
+    -------
+    results : dict
+        Best wall time (s) of both versions and the largest relative
+        difference of their engagement and workload.
+    """
+    freq_bands = config['freq_bands']
+    nfreqs = np.arange(1.0, 65.0)
+    shape = (n_epochs, n_channels, len(nfreqs))
+    psds = np.random.default_rng(0).gamma(2.0, size=shape)
+
+    def per_epoch():
+        return [
+            get_engagement_workload(psds[epoch], nfreqs, freq_bands)
+            for epoch in range(n_epochs)
+        ]
+
+    def batched():
+        return get_band_ratios(psds, nfreqs, freq_bands)
+
+    reference = np.array(per_epoch())
+    band_ratios = batched()
+    difference = max(
+        np.max(np.abs(band_ratios[name] / reference[:, i] - 1))
+        for i, name in enumerate(['engagement', 'workload']))
+
+    results = {
+        'per_epoch': min(timeit.repeat(per_epoch, number=1, repeat=repeat)),
+        'batched': min(timeit.repeat(batched, number=1, repeat=repeat)),
+        'max_rel_difference': difference
+    }
+    print(f"per epoch: {results['per_epoch'] * 1e3:.1f} ms, batched: "
+          f"{results['batched'] * 1e3:.1f} ms, max relative difference "
+          f"{difference:.1e}")
+    return results
+
+
+def _synthetic_eeg(sfreq, duration, n_channels, seed=0):
+    """White noise plus theta, alpha and beta rhythms of varying amplitude."""
+    rng = np.random.default_rng(seed)
+    times = np.arange(int(duration * sfreq)) / sfreq
+    data = rng.standard_normal((n_channels, len(times)))
+    for freq in [6, 10, 20]:
+        amplitude = 1 + np.sin(2 * np.pi * times / rng.uniform(20, 60))
+        data += amplitude * np.sin(2 * np.pi * freq * times +
+                                   rng.uniform(0, 2 * np.pi, (n_channels, 1)))
+    return data * 1e-5
+
+
+def benchmark_psd_methods(config, duration=600, n_channels=30):
+    """Compare the multitaper and Welch PSD for speed and band ratios.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    duration : float
+        Duration (in seconds) of the synthetic recording.
+    n_channels : int
+        Number of channels of the synthetic recording.
+
+    Returns
+    -------
+    results : dict
+        Wall time (s) of both methods and the correlation (across epochs and
+        channels) of their engagement and workload.
+    """
+    sfreq = config['sfreq']
+    data = _synthetic_eeg(sfreq, duration, n_channels)
+    windows, step = get_epoch_windows(data, sfreq, config)
+
+    start = time.perf_counter()
+    psds, nfreqs = compute_multitaper_psd(windows, sfreq, config)
+    multitaper_time = time.perf_counter() - start
+    multitaper = get_band_ratios(psds, nfreqs, config['freq_bands'])
+
+    start = time.perf_counter()
+    psds, nfreqs = compute_welch_psd(data, sfreq, config)
+    welch_time = time.perf_counter() - start
+    welch = get_band_ratios(psds, nfreqs, config['freq_bands'])
+
+    results = {'multitaper': multitaper_time, 'welch': welch_time}
+    for name in ['engagement', 'workload']:
+        results[name + '_correlation'] = np.corrcoef(
+            multitaper[name].ravel(), welch[name].ravel())[0, 1]
+    print(f"multitaper: {multitaper_time:.2f} s, welch: {welch_time:.2f} s, "
+          f"correlation engagement {results['engagement_correlation']:.3f}, "
+          f"workload {results['workload_correlation']:.3f}")
+    return results
+
+
+def benchmark_multitaper_kernel(config,
+                                n_subjects=20,
+                                duration=60,
+                                n_channels=30):
+    """Compare the cached multitaper kernel with MNE on many subjects.
+
+    Each subject is a short synthetic recording, so that the setup cost of
+    every call (tapers, FFT plans) weighs as in a many-subject batch. The
+    in-memory kernel cache is cleared first, the tapers saved in
+    config['spectral_cache_path'] are still used.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    n_subjects : int
+        Number of synthetic recordings.
+    duration : float
+        Duration (in seconds) of each recording.
+    n_channels : int
+        Number of channels of each recording.
+
+    Returns
+    -------
+    results : dict
+        Wall time (s) of both versions over all subjects and the largest
+        relative difference of their PSD.
+    """
+    sfreq = config['sfreq']
+    recordings = [
+        get_epoch_windows(_synthetic_eeg(sfreq, duration, n_channels, seed),
+                          sfreq, config)[0] for seed in range(n_subjects)
+    ]
+    get_multitaper_kernel.cache_clear()
+
+    results = {'mne': 0.0, 'kernel': 0.0, 'max_rel_difference': 0.0}
+    for windows in recordings:
+        start = time.perf_counter()
+        reference, nfreqs = psd_array_multitaper(
+            np.ascontiguousarray(windows),
+            sfreq,
+            fmin=FMIN,
+            fmax=FMAX,
+            bandwidth=config.get('multitaper_bandwidth'),
+            n_jobs=1,
+            verbose=False,
+            normalization='full')
+        results['mne'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        psds, nfreqs = compute_multitaper_psd(windows, sfreq, config, n_jobs=1)
+        results['kernel'] += time.perf_counter() - start
+        results['max_rel_difference'] = max(
+            results['max_rel_difference'],
+            np.max(np.abs(psds / reference - 1)))
+    print(f"{n_subjects} subjects, mne: {results['mne']:.2f} s, cached "
+          f"kernel: {results['kernel']:.2f} s, max relative difference "
+          f"{results['max_rel_difference']:.1e}")
+    return results
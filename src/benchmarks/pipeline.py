@@ -0,0 +1,34 @@
+import time
+
+from data.create_data import create_eeg_data
+
+
+def benchmark_create_eeg_data(config, n_workers=(1, 2, 4)):
+    """Measure the speedup of create_eeg_data with the number of workers.
+
+    A first (untimed) run fills the HDF5 interim store, so that all timed
+    runs read the raw data the same way.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    n_workers : sequence of int
+        Worker counts to compare, the first one is the reference.
+
+    Returns
+    -------
+    results : dict
+        Wall time (s) and speedup for each worker count.
+    """
+    create_eeg_data({**config, 'n_workers': n_workers[0]})
+    results = {}
+    for n in n_workers:
+        start = time.perf_counter()
+        create_eeg_data({**config, 'n_workers': n})
+        wall_time = time.perf_counter() - start
+        speedup = results[n_workers[0]]['wall_time'] / wall_time if results \
+            else 1.0
+        results[n] = {'wall_time': wall_time, 'speedup': speedup}
+        print(f'{n} workers: {wall_time:.2f} s, speedup {speedup:.2f}x')
+    return results
@@ -0,0 +1,150 @@
+import json
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# not from .suite, which imports mne
+from .commit import git_commit
+
+RESULTS_PATH = Path(
+    __file__).parents[2] / 'reports/benchmarks/import_time.jsonl'
+
+# modules main.py and the metadata tools import before any block runs
+LIGHT_MODULES = ['utils', 'pipeline', 'data.xdf_file', 'data.sync']
+# modules of the stages, timed for reference
+STAGE_MODULES = [
+    'data.create_data', 'visualization.visualize', 'features.online'
+]
+# dependencies the light modules must not import
+HEAVY_MODULES = ['mne', 'matplotlib', 'pyxdf']
+
+
+def _import_time(module):
+    """Import a module in a fresh interpreter with -X importtime.
+
+    Returns
+    -------
+    import_time : float
+        Cumulative import time (s) of the module.
+    imported : list of str
+        Names of all modules imported.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parents[1])
+    times, imported = {}, []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3:
+            continue
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue  # header
+        name = fields[2].strip()
+        times[name] = cumulative * 1e-6
+        imported.append(name)
+    return times[module], imported
+
+
+def benchmark_import_time(modules=None, results_path=RESULTS_PATH):
+    """Measure the import time of the entry point and stage modules.
+
+    Each module is imported in a fresh interpreter with python -X
+    importtime. One JSON record per module is appended to results_path,
+    tagged with the git commit, see check_import_time.
+
+    Parameters
+    ----------
+    modules : list of str | None
+        Modules to import, LIGHT_MODULES and STAGE_MODULES if None.
+    results_path : str
+        JSON lines file the results are appended to.
+
+    Returns
+    -------
+    records : list of dicts
+        Import time (s) and heavy dependencies imported by each module.
+    """
+    modules = LIGHT_MODULES + STAGE_MODULES if modules is None else modules
+    run = dict(commit=git_commit(),
+               date=datetime.now().isoformat(timespec='seconds'))
+    records = []
+    for module in modules:
+        import_time, imported = _import_time(module)
+        heavy = sorted(set(imported) & set(HEAVY_MODULES))
+        records.append(
+            dict(**run, module=module, import_time=import_time, heavy=heavy))
+        print(f'{module}: {import_time * 1e3:.0f} ms, heavy imports '
+              f'{heavy or "none"}')
+
+    results_path = Path(results_path)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return records
+
+
+def check_import_time(results_path=RESULTS_PATH, threshold=0.2):
+    """Report import time regressions of the last run.
+
+    A light module (see LIGHT_MODULES) importing a heavy dependency is
+    always reported, other modules are reported if their import time grew
+    by more than threshold since the previous run.
+
+    Parameters
+    ----------
+    results_path : str
+        JSON lines file written by benchmark_import_time.
+    threshold : float
+        Relative increase of import time reported as a regression.
+
+    Returns
+    -------
+    regressions : list of dicts
+        Module, measure and values of the previous and the last run.
+    """
+    with open(results_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    runs = sorted({(record['date'], record['commit']) for record in records})
+    if not runs:
+        return []
+
+    def measures(run):
+        return {
+            record['module']: record
+            for record in records
+            if (record['date'], record['commit']) == run
+        }
+
+    last = measures(runs[-1])
+    regressions = []
+    for module, record in last.items():
+        if module in LIGHT_MODULES and record['heavy']:
+            regressions.append(
+                dict(module=module,
+                     measure='heavy',
+                     previous=None,
+                     last=record['heavy']))
+            print(f"{module} imports {record['heavy']}")
+    if len(runs) < 2:
+        return regressions
+
+    previous = measures(runs[-2])
+    for module in previous.keys() & last.keys():
+        before = previous[module]['import_time']
+        after = last[module]['import_time']
+        if after > before * (1 + threshold) and after - before > 1e-2:
+            regressions.append(
+                dict(module=module,
+                     measure='import_time',
+                     previous=before,
+                     last=after))
+            print(f'{module}: import time {before:.3f} -> {after:.3f} s '
+                  f'({runs[-2][1]} -> {runs[-1][1]})')
+    return regressions
@@ -0,0 +1,203 @@
+import itertools
+import json
+import multiprocessing
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import mne
+import yaml
+
+from data.create_data import get_band_ratios
+from data.mne_import_xdf import (_create_info, _find_stream_by_type,
+                                 load_index, open_xdf, read_stream)
+from features.psd import compute_multitaper_psd, get_epoch_windows
+from utils import _peak_rss
+
+from .commit import git_commit
+from .synthetic import write_synthetic_xdf
+
+RESULTS_PATH = Path(__file__).parents[2] / 'reports/benchmarks/suite.jsonl'
+
+
+def _run_stages(fname, config):
+    """Run and measure the pipeline stages on one file.
+
+    Meant to run in a fresh process: the peak resident set size after each
+    stage is the high-water mark of the process, so a stage raising it
+    shows up as an increase over the previous stage.
+    """
+    stages = []
+
+    def measure(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        stages.append(
+            dict(stage=stage,
+                 wall_time=time.perf_counter() - start,
+                 peak_rss=_peak_rss()))
+        return result
+
+    def parse():
+        index, streams = load_index(fname)
+        stream = _find_stream_by_type(streams, stream_type='EEG')
+        with open_xdf(fname) as f:
+            return read_stream(f, index, stream)
+
+    def scale_transpose(stream):
+        info, scale = _create_info(stream['info'])
+        return mne.io.RawArray((stream['time_series'] * scale).T,
+                               info,
+                               verbose=False)
+
+    import_rss = _peak_rss()
+    stream = measure('parse', parse)
+    raw = measure('scale_transpose', scale_transpose, stream)
+    del stream
+    sfreq = raw.info['sfreq']
+    windows, step = measure('epoching', get_epoch_windows, raw.get_data(),
+                            sfreq, config)
+    psds, nfreqs = measure('psd', compute_multitaper_psd, windows, sfreq,
+                           config, 1)
+    measure('band_ratios', get_band_ratios, psds, nfreqs,
+            config['freq_bands'])
+    return stages, import_rss
+
+
+def run_benchmark_suite(config,
+                        durations=(60, 600),
+                        n_channels=(32, 64),
+                        sfreq=500,
+                        marker_rate=0.5,
+                        compression=None,
+                        results_path=RESULTS_PATH):
+    """Time and memory-profile the ingestion and feature stages.
+
+    For every combination of duration and number of channels a synthetic
+    XDF file is written (see write_synthetic_xdf) and processed in a
+    freshly spawned process through the stages parse (chunk index and EEG
+    stream decoding), scale_transpose (conversion to volts and RawArray),
+    epoching, psd (multitaper, one job) and band_ratios. One JSON record
+    per stage is appended to results_path, tagged with the git commit, so
+    that runs of different commits can be compared with
+    compare_benchmark_runs.
+
+    The spawned processes import the main module again, which must guard
+    its code with `if __name__ == '__main__':`, as main.py does and as
+    running this module (python -m benchmarks.suite, from src) does.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary (epoching and frequency bands).
+    durations : tuple of float
+        Durations (in seconds) of the synthetic recordings.
+    n_channels : tuple of int
+        Numbers of EEG channels of the synthetic recordings.
+    sfreq : float
+        Sampling rate of the synthetic recordings.
+    marker_rate : float
+        Mean number of markers per second.
+    compression : None | 'gzip' | 'block_gzip'
+        Compression of the synthetic recordings.
+    results_path : str
+        JSON lines file the results are appended to.
+
+    Returns
+    -------
+    records : list of dicts
+        Wall time (s) and peak resident set size (MB) of each stage and
+        size.
+    """
+    run = dict(commit=git_commit(),
+               date=datetime.now().isoformat(timespec='seconds'))
+    context = multiprocessing.get_context('spawn')
+    records = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for duration, n_chans in itertools.product(durations, n_channels):
+            suffix = '.xdf' if compression is None else '.xdfz'
+            fname = write_synthetic_xdf(Path(temp_dir) / f'eeg{suffix}',
+                                        n_channels=n_chans,
+                                        sfreq=sfreq,
+                                        duration=duration,
+                                        marker_rate=marker_rate,
+                                        compression=compression)
+            size = dict(duration=duration,
+                        n_channels=n_chans,
+                        sfreq=sfreq,
+                        compression=compression,
+                        file_size=fname.stat().st_size / 2**20)
+            with context.Pool(1) as pool:
+                stages, import_rss = pool.apply(_run_stages, (fname, config))
+            for stage in stages:
+                records.append(dict(**run, **size, **stage,
+                                    import_rss=import_rss))
+                print(f"{duration} s x {n_chans} channels, "
+                      f"{stage['stage']}: {stage['wall_time']:.3f} s, "
+                      f"peak RSS {stage['peak_rss']:.0f} MB")
+            fname.unlink()
+            Path(str(fname) + '.index.npz').unlink(missing_ok=True)
+
+    results_path = Path(results_path)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return records
+
+
+def compare_benchmark_runs(results_path=RESULTS_PATH, threshold=0.1):
+    """Report the stages that got slower or bigger since the previous run.
+
+    Parameters
+    ----------
+    results_path : str
+        JSON lines file written by run_benchmark_suite.
+    threshold : float
+        Relative increase of wall time or peak resident set size reported
+        as a regression.
+
+    Returns
+    -------
+    regressions : list of dicts
+        Stage, size, measure and values of the previous and the last run.
+    """
+    with open(results_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    runs = sorted({(record['date'], record['commit']) for record in records})
+    if len(runs) < 2:
+        return []
+
+    def measures(run):
+        return {(record['stage'], record['duration'], record['n_channels'],
+                 record['compression']): record
+                for record in records
+                if (record['date'], record['commit']) == run}
+
+    previous, last = measures(runs[-2]), measures(runs[-1])
+    regressions = []
+    for key in previous.keys() & last.keys():
+        for measure in ['wall_time', 'peak_rss']:
+            before, after = previous[key][measure], last[key][measure]
+            if after > before * (1 + threshold) and after - before > 1e-3:
+                regressions.append(
+                    dict(stage=key[0],
+                         duration=key[1],
+                         n_channels=key[2],
+                         compression=key[3],
+                         measure=measure,
+                         previous=before,
+                         last=after))
+                print(f'{key[0]} ({key[1]} s x {key[2]} channels): '
+                      f'{measure} {before:.3f} -> {after:.3f} '
+                      f'({runs[-2][1]} -> {runs[-1][1]})')
+    return regressions
+
+
+if __name__ == '__main__':
+    config_path = Path(__file__).parents[1] / 'config.yml'
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.SafeLoader)
+    run_benchmark_suite(config)
+    compare_benchmark_runs()
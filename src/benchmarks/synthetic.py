@@ -0,0 +1,173 @@
+import gzip
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from data.block_gzip import compress_xdf
+
+# channel labels of the synthetic EEG stream, cycled for more channels
+CHANNELS = [
+    'Fp1', 'Fp2', 'AF3', 'AF4', 'F7', 'F8', 'F3', 'Fz', 'F4', 'FC5', 'FC6',
+    'T7', 'T8', 'C3', 'Cz', 'C4', 'CP5', 'CP6', 'P7', 'P8', 'P3', 'Pz', 'P4',
+    'PO7', 'PO8', 'PO3', 'PO4', 'O1', 'O2', 'A2'
+]
+
+
+def _varlen(n):
+    """Encode a variable-length integer."""
+    if n < 2**8:
+        return b'\x01' + struct.pack('<B', n)
+    if n < 2**32:
+        return b'\x04' + struct.pack('<I', n)
+    return b'\x08' + struct.pack('<Q', n)
+
+
+def _chunk(tag, content):
+    """Encode a chunk with its length and tag."""
+    return _varlen(len(content) + 2) + struct.pack('<H', tag) + content
+
+
+def _stream_header(stream_id, name, stream_type, ch_names, srate, fmt):
+    """Encode a StreamHeader chunk."""
+    channels = ''.join(f'<channel><label>{ch_name}</label><type>'
+                       f'{stream_type}</type><unit>microvolts</unit>'
+                       f'</channel>' for ch_name in ch_names)
+    xml = (f'<?xml version="1.0"?><info><name>{name}</name><type>'
+           f'{stream_type}</type><channel_count>{len(ch_names)}'
+           f'</channel_count><nominal_srate>{srate}</nominal_srate>'
+           f'<channel_format>{fmt}</channel_format><source_id>synthetic'
+           f'</source_id><desc><channels>{channels}</channels></desc></info>')
+    return _chunk(2, struct.pack('<I', stream_id) + xml.encode())
+
+
+def _eeg_samples(stream_id, time_stamps, data):
+    """Encode a Samples chunk of numeric samples that all have time stamps."""
+    layout = np.dtype([('flag', 'u1'), ('time_stamp', '<f8'),
+                       ('values', data.dtype, (data.shape[1], ))])
+    samples = np.empty(len(data), dtype=layout)
+    samples['flag'] = 8
+    samples['time_stamp'] = time_stamps
+    samples['values'] = data
+    return _chunk(
+        3,
+        struct.pack('<I', stream_id) + _varlen(len(data)) +
+        samples.tobytes())
+
+
+def _marker_samples(stream_id, time_stamps, markers):
+    """Encode a Samples chunk of string markers."""
+    content = [struct.pack('<I', stream_id), _varlen(len(markers))]
+    for time_stamp, marker in zip(time_stamps, markers):
+        marker = marker.encode()
+        content += [b'\x08', struct.pack('<d', time_stamp),
+                    _varlen(len(marker)), marker]
+    return _chunk(3, b''.join(content))
+
+
+def write_synthetic_xdf(fname,
+                        n_channels=30,
+                        sfreq=500,
+                        duration=60,
+                        marker_rate=0.5,
+                        compression=None,
+                        chunk_duration=0.1,
+                        seed=0):
+    """Write an XDF file with a synthetic EEG and Markers stream.
+
+    The EEG (float32, in microvolts) is white noise with a 10 Hz alpha
+    rhythm, with slightly jittered time stamps on every sample. The markers
+    ('event_0' to 'event_2') follow a Poisson process. Each stream gets a
+    ClockOffset chunk every 5 seconds. The file is written chunk by chunk,
+    so long recordings do not need to fit in memory.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file to write.
+    n_channels : int
+        Number of EEG channels.
+    sfreq : float
+        Sampling rate of the EEG stream.
+    duration : float
+        Duration (in seconds) of the recording.
+    marker_rate : float
+        Mean number of markers per second.
+    compression : None | 'gzip' | 'block_gzip'
+        Compression of the file, 'block_gzip' uses block_gzip.compress_xdf.
+    chunk_duration : float
+        Duration (in seconds) of the EEG samples chunks.
+    seed : int
+        Seed of the random number generator.
+
+    Returns
+    -------
+    fname : Path
+        Name of the written file.
+    """
+    fname = Path(fname)
+    rng = np.random.default_rng(seed)
+    ch_names = [
+        CHANNELS[i % len(CHANNELS)] + ('' if i < len(CHANNELS) else
+                                       str(i // len(CHANNELS)))
+        for i in range(n_channels)
+    ]
+    n_times = int(duration * sfreq)
+    chunk_size = max(int(chunk_duration * sfreq), 1)
+    start_time = 1000.0
+    marker_times = np.sort(
+        rng.uniform(start_time, start_time + duration,
+                    rng.poisson(marker_rate * duration)))
+    alpha = rng.uniform(5, 20, n_channels).astype('float32')
+
+    raw_fname = fname.with_name(fname.name + '.tmp') \
+        if compression == 'block_gzip' else fname
+    opener = gzip.open if compression == 'gzip' else open
+    with opener(raw_fname, 'wb') as f:
+        f.write(b'XDF:')
+        f.write(
+            _chunk(1, b'<?xml version="1.0"?><info><version>1.0</version>'
+                   b'</info>'))
+        f.write(_stream_header(1, 'SyntheticEEG', 'EEG', ch_names, sfreq,
+                               'float32'))
+        f.write(_stream_header(2, 'SyntheticMarkers', 'Markers', ['marker'],
+                               0, 'string'))
+        n_markers, next_offset = 0, 0.0
+        for start in range(0, n_times, chunk_size):
+            samples = np.arange(start, min(start + chunk_size, n_times))
+            time_stamps = start_time + samples / sfreq + rng.normal(
+                0, 1e-4, len(samples))
+            data = rng.standard_normal((len(samples), n_channels),
+                                       dtype='float32') * 10
+            data += alpha * np.sin(2 * np.pi * 10 * samples / sfreq,
+                                   dtype='float32')[:, None]
+            f.write(_eeg_samples(1, time_stamps, data))
+
+            stop = np.searchsorted(marker_times, time_stamps[-1], 'right')
+            if stop > n_markers:
+                f.write(
+                    _marker_samples(
+                        2, marker_times[n_markers:stop],
+                        [f'event_{k % 3}' for k in range(n_markers, stop)]))
+                n_markers = stop
+
+            if time_stamps[0] >= start_time + next_offset:
+                for stream_id in (1, 2):
+                    f.write(
+                        _chunk(
+                            4,
+                            struct.pack('<Idd', stream_id, time_stamps[0],
+                                        rng.normal(0.01, 1e-4))))
+                next_offset += 5.0
+        for stream_id in (1, 2):
+            f.write(
+                _chunk(
+                    6,
+                    struct.pack('<I', stream_id) +
+                    b'<?xml version="1.0"?><info></info>'))
+
+    if compression == 'block_gzip':
+        compress_xdf(raw_fname, fname)
+        os.remove(raw_fname)
+    return fname
@@ -0,0 +1,164 @@
+import gzip
+import multiprocessing
+import shutil
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+from pyxdf import load_xdf
+
+from data.block_gzip import compress_xdf
+from data.mne_import_xdf import (_find_stream_by_type, build_index,
+                                 load_index, open_xdf, read_stream)
+from utils import _peak_rss
+
+
+def _read_eeg_stream(fname, last=None):
+    """Decode the first EEG stream only, or its last seconds."""
+    index, streams = load_index(fname)
+    stream = _find_stream_by_type(streams, stream_type="EEG")
+    tmin = None if last is None else np.nanmax(index["last_time"]) - last
+    with open_xdf(fname) as f:
+        return read_stream(f, index, stream, tmin=tmin)
+
+
+READERS = {'load_xdf': load_xdf, 'read_stream': _read_eeg_stream}
+
+
+def _time_reader(reader, fname):
+    """Time one reader call, meant to run in a fresh process."""
+    baseline = _peak_rss()
+    start = time.perf_counter()
+    READERS[reader](fname)
+    wall_time = time.perf_counter() - start
+    return wall_time, _peak_rss(), baseline
+
+
+def benchmark_xdf_reader(fname, repeat=3):
+    """Compare wall time and peak memory of the XDF readers.
+
+    Every run is done in a freshly spawned process so that the peak resident
+    set size of one reader does not leak into the next measurement. The
+    spawned processes import the main module again, which must therefore
+    guard its code with `if __name__ == '__main__':` (see main.py).
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+    repeat : int
+        Number of runs per reader.
+
+    Returns
+    -------
+    results : dict
+        Best wall time (s) and peak resident set size (MB) of each reader.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for reader in READERS:
+        runs = []
+        for _ in range(repeat):
+            with context.Pool(1) as pool:
+                runs.append(pool.apply(_time_reader, (reader, fname)))
+        wall_time, peak, baseline = min(runs)
+        results[reader] = {
+            'wall_time': wall_time,
+            'peak_rss': peak,
+            'import_rss': baseline
+        }
+        print(f'{reader}: {wall_time:.2f} s, peak RSS {peak:.0f} MB '
+              f'({peak - baseline:.0f} MB above imports)')
+    return results
+
+
+def benchmark_compressed_xdf(fname):
+    """Compare reading a gzip and a block gzip compressed XDF file.
+
+    Both compressed copies are written to a temporary directory. For each,
+    the time to index the file (resolving the streams), to decode the EEG
+    stream and to decode only its last minute is measured.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the (uncompressed) XDF file.
+
+    Returns
+    -------
+    results : dict
+        Index, read and last minute read time (s) of each format.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        gzip_fname = Path(temp_dir) / 'gzip.xdfz'
+        with open(fname, 'rb') as source, \
+                gzip.open(gzip_fname, 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target)
+        block_fname = Path(temp_dir) / 'block.xdfz'
+        compress_xdf(fname, block_fname)
+
+        for name, compressed in [('gzip', gzip_fname),
+                                 ('block_gzip', block_fname)]:
+            start = time.perf_counter()
+            build_index(compressed)
+            index_time = time.perf_counter() - start
+            start = time.perf_counter()
+            _read_eeg_stream(compressed)
+            read_time = time.perf_counter() - start
+            start = time.perf_counter()
+            _read_eeg_stream(compressed, last=60)
+            range_time = time.perf_counter() - start
+            results[name] = {
+                'index_time': index_time,
+                'read_time': read_time,
+                'range_time': range_time
+            }
+            print(f'{name}: index {index_time:.2f} s, read EEG stream '
+                  f'{read_time:.2f} s, read last minute {range_time:.2f} s')
+    return results
+
+
+def _read_all_streams(fname):
+    """Decode all streams of an XDF file."""
+    index, streams = load_index(fname)
+    with open_xdf(fname) as f:
+        return [read_stream(f, index, stream) for stream in streams]
+
+
+def benchmark_decoding_throughput(fname, repeat=3):
+    """Measure the decoding throughput of read_stream and load_xdf.
+
+    Both readers decode all streams of the file (pyxdf without clock
+    synchronization and dejittering, which read_stream does not do).
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+    repeat : int
+        Number of timed runs, the best one is reported.
+
+    Returns
+    -------
+    results : dict
+        Throughput (MB/s of file size) of each reader.
+    """
+    size = Path(fname).stat().st_size / 2**20
+    load_index(fname)  # the index is built once per file
+    readers = {
+        'load_xdf':
+        lambda: load_xdf(
+            fname, synchronize_clocks=False, dejitter_timestamps=False),
+        'read_stream':
+        lambda: _read_all_streams(fname)
+    }
+    results = {}
+    for name, reader in readers.items():
+        wall_time = min(
+            timeit.repeat(reader, number=1, repeat=repeat))
+        results[name] = size / wall_time
+        print(f'{name}: {size / wall_time:.0f} MB/s')
+    return results
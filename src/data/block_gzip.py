@@ -0,0 +1,194 @@
+import gzip
+import io
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# gzip member header with the FEXTRA flag and one "XB" subfield holding the
+# size of the member and of its uncompressed data
+_HEADER = struct.Struct('<4sI2sHBBHII')
+_MAGIC = b'\x1f\x8b\x08\x04'  # gzip magic, deflate, FEXTRA
+_SUBFIELD = b'XB'
+
+
+def is_block_gzip(fname):
+    """Check whether a file is written in the block gzip format."""
+    with open(fname, 'rb') as f:
+        header = f.read(_HEADER.size)
+    return (len(header) == _HEADER.size and header[:4] == _MAGIC
+            and header[12:14] == _SUBFIELD)
+
+
+def compress_xdf(fname, out_fname, block_size=2**22, level=6, n_workers=4):
+    """Compress an XDF file into independently compressed blocks.
+
+    Every block of block_size uncompressed bytes is written as a separate
+    gzip member whose header records its compressed and uncompressed size
+    (similar to BGZF). The result is a valid gzip file, so it can still be
+    read with gzip.open or pyxdf, while BlockGzipFile can seek to any block
+    and decompress blocks in parallel. Existing .xdfz / .xdf.gz files are
+    converted the same way.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the (plain or gzip-compressed) XDF file.
+    out_fname : str
+        Name of the compressed file to write.
+    block_size : int
+        Number of uncompressed bytes per block.
+    level : int
+        Compression level.
+    n_workers : int
+        Number of threads compressing blocks.
+    """
+    if str(fname).endswith(('.xdfz', '.gz')):
+        source = gzip.open(fname, 'rb')
+    else:
+        source = open(fname, 'rb')
+    with source, open(out_fname, 'wb') as f, \
+            ThreadPoolExecutor(n_workers) as executor:
+        while True:
+            blocks = [source.read(block_size) for _ in range(n_workers)]
+            blocks = [block for block in blocks if block]
+            if not blocks:
+                break
+            for member in executor.map(_compress_block, blocks,
+                                       [level] * len(blocks)):
+                f.write(member)
+
+
+def _compress_block(block, level):
+    """Compress a block into a gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(block) + compressor.flush()
+    member_size = _HEADER.size + len(data) + 8
+    header = _HEADER.pack(_MAGIC, 0, b'\x00\xff', 12, ord('X'), ord('B'), 8,
+                          member_size, len(block))
+    trailer = struct.pack('<II', zlib.crc32(block), len(block) & 0xffffffff)
+    return header + data + trailer
+
+
+class BlockGzipFile(io.RawIOBase):
+    """Seekable reader of files written by compress_xdf.
+
+    The block table is built from the member headers only, so opening a
+    file does not decompress anything. Reading a block submits the
+    decompression of the next n_workers blocks to a thread pool, so that
+    sequential reads decompress in parallel.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the compressed file.
+    n_workers : int
+        Number of threads decompressing blocks.
+
+    """
+    def __init__(self, fname, n_workers=4):
+        super(BlockGzipFile, self).__init__()
+        self.fd = os.open(fname, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self.blocks = self._read_block_table()
+        self.size = self.blocks[-1][1] + self.blocks[-1][2] \
+            if self.blocks else 0
+        self.position = 0
+        self.n_workers = n_workers
+        self.executor = ThreadPoolExecutor(n_workers)
+        self.cache = {}
+
+    def _read_block_table(self):
+        """List (compressed offset, uncompressed offset, size) of blocks.
+
+        An incomplete last block (of a truncated file) is left out.
+        """
+        blocks, offset, position = [], 0, 0
+        file_size = os.fstat(self.fd).st_size
+        while True:
+            header = os.pread(self.fd, _HEADER.size, offset)
+            if len(header) < _HEADER.size:
+                return blocks
+            (magic, mtime, flags, xlen, si1, si2, length, member_size,
+             block_size) = _HEADER.unpack(header)
+            if magic != _MAGIC or bytes([si1, si2]) != _SUBFIELD:
+                raise IOError('Not a block gzip file.')
+            if offset + member_size > file_size:
+                return blocks
+            blocks.append((offset, position, block_size))
+            offset += member_size
+            position += block_size
+
+    def _decompress(self, block):
+        """Read and decompress a block."""
+        offset = self.blocks[block][0]
+        if block + 1 < len(self.blocks):
+            member_size = self.blocks[block + 1][0] - offset
+        else:  # a truncated file can end with an incomplete member
+            member_size = _HEADER.unpack(
+                os.pread(self.fd, _HEADER.size, offset))[7]
+        member = os.pread(self.fd, member_size, offset)
+        data = zlib.decompress(member[_HEADER.size:-8], -zlib.MAX_WBITS)
+        crc, = struct.unpack('<I', member[-8:-4])
+        if zlib.crc32(data) != crc:
+            raise IOError(f'CRC check failed for block {block}.')
+        return data
+
+    def _get_block(self, block):
+        """Return a decompressed block and read ahead the next ones."""
+        for ahead in range(block, min(block + self.n_workers,
+                                      len(self.blocks))):
+            if ahead not in self.cache:
+                self.cache[ahead] = self.executor.submit(
+                    self._decompress, ahead)
+        for cached in list(self.cache):
+            if not block <= cached < block + self.n_workers:
+                del self.cache[cached]
+        return self.cache[block].result()
+
+    def _find_block(self, position):
+        """Index of the block containing an uncompressed position."""
+        low, high = 0, len(self.blocks) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.blocks[middle][1] <= position:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        n_read = 0
+        while n_read < len(view) and self.position < self.size:
+            block = self._find_block(self.position)
+            data = self._get_block(block)
+            start = self.position - self.blocks[block][1]
+            n = min(len(data) - start, len(view) - n_read)
+            view[n_read:n_read + n] = data[start:start + n]
+            n_read += n
+            self.position += n
+        return n_read
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.cache.clear()
+            os.close(self.fd)
+        super(BlockGzipFile, self).close()
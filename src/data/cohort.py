@@ -0,0 +1,216 @@
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .create_data import (EEG_CH_NAMES, _init_worker, compute_eeg_features,
+                          get_worker_config, get_xdf_path, read_raw_eeg)
+from .mne_import_xdf import _select_stream, load_index
+from features.psd import get_n_epochs
+from utils import add_profile_records, pop_profile_records, profile_stage
+
+logger = logging.getLogger()
+
+# band powers of the cohort in a worker process, see _init_cohort_worker
+_cohort = {}
+
+
+def get_cohort_offsets(config):
+    """First epoch of each subject in the cohort feature array.
+
+    The number of epochs of a subject is known from the chunk index of its
+    XDF file, so the array can be allocated before any subject is read.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    offsets : array of int, shape (n_subjects + 1, )
+        The epochs of subject i are offsets[i] to offsets[i + 1].
+    """
+    n_epochs = []
+    for subject in config['subjects']:
+        index, streams = load_index(get_xdf_path(config, subject))
+        stream = _select_stream(streams)
+        chunks = index[(index["tag"] == 3)
+                       & (index["stream_id"] == stream["stream_id"])]
+        n_epochs.append(
+            get_n_epochs(int(chunks["n_samples"].sum()),
+                         float(stream["nominal_srate"]), config))
+    return np.concatenate(([0], np.cumsum(n_epochs))).astype(int)
+
+
+def _init_cohort_worker(lock, name, shape):
+    """Initialize a worker process of create_cohort_features."""
+    _init_worker(lock)
+    # the parent owns and unlinks the block. Workers started by
+    # multiprocessing (fork, spawn or forkserver) share the resource tracker
+    # of the parent, where registering the block again is a no-op, so it
+    # must not be unregistered (the parent could not unregister it anymore)
+    if sys.version_info >= (3, 13):
+        shm = SharedMemory(name=name, track=False)
+    else:
+        shm = SharedMemory(name=name)
+    _cohort.update(shm=shm,
+                   band_powers=np.ndarray(shape, dtype=float,
+                                          buffer=shm.buf))
+
+
+def _write_subject(config, subject, band_powers, start, stop):
+    """Compute the band powers of a subject into band_powers[start:stop].
+
+    Returns
+    -------
+    n_epochs : int
+        Number of epochs of the subject, only the first stop - start are
+        written if it differs from the expected number.
+    """
+    with profile_stage('read_raw_xdf', subject=subject):
+        raw = read_raw_eeg(config, subject)
+    with profile_stage('feature_extraction', subject=subject):
+        features = compute_eeg_features(raw,
+                                        config,
+                                        picks=EEG_CH_NAMES,
+                                        subject=subject)
+    n_epochs = len(features['band_powers'])
+    if n_epochs != stop - start:
+        logger.warning(f'S_{subject} has {n_epochs} epochs, expected '
+                       f'{stop - start}')
+    n = min(n_epochs, stop - start)
+    band_powers[start:start + n] = features['band_powers'][:n]
+    return n_epochs
+
+
+def _write_subject_shared(config, subject, start, stop):
+    """Process a subject in a worker, returning its stage records too."""
+    n_epochs = _write_subject(config, subject, _cohort['band_powers'], start,
+                              stop)
+    return n_epochs, pop_profile_records()
+
+
+def create_cohort_features(config):
+    """Compute the band powers of all subjects into one array.
+
+    The band powers of all subjects are stacked along the epochs in a
+    single ragged array of shape (n_epochs, n_channels, n_bands), the
+    epochs of subject i being offsets[i] to offsets[i + 1] (see
+    get_cohort_offsets). With config['n_workers'] > 1, the array lives in
+    a shared memory block that the workers write to directly, so only the
+    number of epochs and the stage records are sent back to the parent.
+    The epochs of a subject whose processing fails (or that has fewer
+    epochs than expected) are left as NaN.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    cohort : dict
+        Band powers of all epochs, the offsets of each subject, the
+        subject IDs and the channel names.
+    """
+    subjects = config['subjects']
+    offsets = get_cohort_offsets(config)
+    shape = (offsets[-1], len(EEG_CH_NAMES), len(config['freq_bands']))
+    n_workers = min(config.get('n_workers', 1), len(subjects))
+    cohort = dict(offsets=offsets,
+                  subjects=list(subjects),
+                  ch_names=list(EEG_CH_NAMES))
+
+    if n_workers <= 1:
+        band_powers = np.full(shape, np.nan)
+        for i, subject in enumerate(subjects):
+            try:
+                _write_subject(config, subject, band_powers, offsets[i],
+                               offsets[i + 1])
+            except Exception:
+                logger.exception(f'Failed to process subject S_{subject}')
+        return dict(cohort, band_powers=band_powers)
+
+    worker_config = get_worker_config(config, n_workers)
+    shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        band_powers = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        band_powers[:] = np.nan
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_cohort_worker,
+                                 initargs=(multiprocessing.Lock(), shm.name,
+                                           shape)) as executor:
+            futures = {
+                executor.submit(_write_subject_shared, worker_config,
+                                subject, offsets[i], offsets[i + 1]): subject
+                for i, subject in enumerate(subjects)
+            }
+            for future in as_completed(futures):
+                subject = futures[future]
+                try:
+                    _, records = future.result()
+                    add_profile_records(records)
+                except Exception:
+                    logger.exception(f'Failed to process subject S_{subject}')
+        # copy out of the shared block so that it can be released
+        cohort['band_powers'] = band_powers.copy()
+        del band_powers
+    finally:
+        shm.close()
+        shm.unlink()
+    return cohort
+
+
+def _subject_sums(values, offsets):
+    """Sum and number of finite values of each subject along axis 0."""
+    valid = np.isfinite(values)
+    zero = np.zeros((1, ) + values.shape[1:])
+    sums = np.concatenate((zero, np.cumsum(np.where(valid, values, 0),
+                                           axis=0)))
+    counts = np.concatenate((zero, np.cumsum(valid, axis=0)))
+    return (sums[offsets[1:]] - sums[offsets[:-1]],
+            counts[offsets[1:]] - counts[offsets[:-1]])
+
+
+def get_group_statistics(cohort):
+    """Per-subject and group statistics of the engagement and workload.
+
+    The engagement beta / (alpha + theta) and workload theta / alpha of all
+    epochs are computed at once from the band powers of the cohort, and
+    reduced per subject from cumulative sums over the offsets. NaN epochs
+    (see create_cohort_features) are ignored.
+
+    Parameters
+    ----------
+    cohort : dict
+        Cohort features as returned by create_cohort_features.
+
+    Returns
+    -------
+    statistics : dict
+        For 'engagement' and 'workload', a dict with the mean and standard
+        deviation of each subject and channel (shape (n_subjects,
+        n_channels)) and the mean and standard deviation over the subjects
+        of the subject means (shape (n_channels, )).
+    """
+    band_powers = cohort['band_powers']
+    offsets = cohort['offsets']
+    theta, alpha, beta = (band_powers[..., i] for i in range(3))
+    indices = dict(engagement=beta / (alpha + theta), workload=theta / alpha)
+
+    statistics = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name, values in indices.items():
+            sums, counts = _subject_sums(values, offsets)
+            squares, _ = _subject_sums(values**2, offsets)
+            mean = sums / counts
+            std = np.sqrt(np.maximum(squares / counts - mean**2, 0))
+            statistics[name] = dict(subject_mean=mean,
+                                    subject_std=std,
+                                    group_mean=np.nanmean(mean, axis=0),
+                                    group_std=np.nanstd(mean, axis=0))
+    return statistics
@@ -1,89 +1,508 @@
 import collections
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 
-import mne
+import numpy as np
 from .mne_import_xdf import read_raw_xdf
-import matplotlib.pyplot as plt
-from mne.time_frequency import psd_multitaper
+from .utils import (get_psd_shape, load_psd_blocks, load_raw, raw_cache_key,
+                    save_features, save_psd_block, save_raw, set_store_lock)
+from features.artifacts import (find_artifacts,
+                                find_artifacts_from_statistics,
+                                get_block_statistics)
+from features.psd import (compute_psd, get_epoch_step, get_n_epochs,
+                          iter_psd_blocks)
+from pipeline import Stage
+from utils import (add_profile_records, pop_profile_records, profile_stage,
+                   reset_profiling)
+
+logger = logging.getLogger()
+
+# EEG channels the features are computed on
+EEG_CH_NAMES = [
+    'Fp1', 'Fp2', 'AF3', 'AF4', 'F7', 'F8', 'F3', 'Fz', 'F4', 'FC5', 'FC6',
+    'T7', 'T8', 'C3', 'Cz', 'C4', 'CP5', 'CP6', 'P7', 'P8', 'P3', 'Pz', 'P4',
+    'PO7', 'PO8', 'PO3', 'PO4', 'O1', 'O2', 'A2'
+]
 
 
 def get_engagement_workload(psds, nfreqs, freq_bands):
     beta_mask = (nfreqs >= freq_bands[2][0]) & (nfreqs <= freq_bands[2][1])
-    beta_data = psds[:, beta_mask]
+    beta_data = psds[..., beta_mask]
     alpha_mask = (nfreqs >= freq_bands[1][0]) & (nfreqs <= freq_bands[1][1])
-    alpha_data = psds[:, alpha_mask]
+    alpha_data = psds[..., alpha_mask]
     theta_mask = (nfreqs >= freq_bands[0][0]) & (nfreqs <= freq_bands[0][1])
-    theta_data = psds[:, theta_mask]
+    theta_data = psds[..., theta_mask]
     # Engagement
-    engagement = beta_data.mean(axis=1) / (alpha_data.mean(axis=1) +
-                                           theta_data.mean(axis=1))
-    workload = (theta_data.mean(axis=1) / alpha_data.mean(axis=1))
+    engagement = beta_data.mean(axis=-1) / (alpha_data.mean(axis=-1) +
+                                            theta_data.mean(axis=-1))
+    workload = (theta_data.mean(axis=-1) / alpha_data.mean(axis=-1))
     return engagement, workload
 
 
-# Calculate the psd values
-def animate(epochs, config):
-    n_epochs = len(epochs.events)
-    labels = [r'$\beta/(\alpha + \theta)$', r'$\theta/(\alpha)$']
-    title = ['Engagement', 'Workload']
-    info = mne.pick_info(epochs.info, mne.pick_types(epochs.info, eeg=True))
-    freq_bands = config['freq_bands']
-    psds, nfreqs = psd_multitaper(epochs,
-                                  fmin=1.0,
-                                  fmax=64.0,
-                                  n_jobs=6,
-                                  verbose=False,
-                                  normalization='full')
-    fig, ax = plt.subplots(1, 2, figsize=[10, 5])
-    for epoch in range(n_epochs):
-        # Engagement index beta/(alpha + theta)
-        engagement, workload = get_engagement_workload(psds[epoch, :, :],
-                                                       nfreqs, freq_bands)
-
-        for i in range(len(labels)):
-            if i == 0:
-                mne.viz.plot_topomap(engagement,
-                                     pos=info,
-                                     axes=ax[i],
-                                     show=False,
-                                     cmap='viridis')
-                ax[i].set_ylabel(labels[i])
-                ax[i].title.set_text(title[i])
-            else:
-                mne.viz.plot_topomap(workload,
-                                     pos=info,
-                                     axes=ax[i],
-                                     show=False,
-                                     cmap='viridis')
-                ax[i].set_ylabel(labels[i])
-                ax[i].title.set_text(title[i])
-
-        plt.pause(0.01)
-        for i in range(len(labels)):
-            ax[i].cla()
+def get_band_matrix(nfreqs, freq_bands):
+    """Matrix averaging the PSD over each frequency band.
 
+    Parameters
+    ----------
+    nfreqs : array, shape (n_freqs, )
+        Frequencies of the PSD.
+    freq_bands : list of lists
+        Lower and upper (inclusive) frequency of each band.
 
-def read_xdf_eeg_data(config, subject):
-    read_path = config['raw_eeg_path'] + 'S_' + subject + '/eeg.xdf'
-    raw = read_raw_xdf(read_path)
-    raw = raw.drop_channels(
-        ['ACC30', 'ACC31', 'ACC32', 'Packet Counter', 'TRIGGER'])
-    raw.set_montage(montage="standard_1020", set_dig=True, verbose=False)
-    ch_names = [
-        'Fp1', 'Fp2', 'AF3', 'AF4', 'F7', 'F8', 'F3', 'Fz', 'F4', 'FC5', 'FC6',
-        'T7', 'T8', 'C3', 'Cz', 'C4', 'CP5', 'CP6', 'P7', 'P8', 'P3', 'Pz',
-        'P4', 'PO7', 'PO8', 'PO3', 'PO4', 'O1', 'O2', 'A2'
-    ]
-    epoch_length = config['epoch_length']
-    events = mne.make_fixed_length_events(raw, duration=epoch_length)
-    epochs = mne.Epochs(raw, events, picks=ch_names, verbose=False)
-    animate(epochs, config)
+    Returns
+    -------
+    band_matrix : array, shape (n_freqs, n_bands)
+        Column b holds 1 / n for the n frequencies of band b, 0 elsewhere.
+    """
+    nfreqs = np.asarray(nfreqs)
+    bands = np.asarray(freq_bands, dtype=float)
+    masks = (nfreqs[:, None] >= bands[:, 0]) & (nfreqs[:, None] <= bands[:, 1])
+    return masks / masks.sum(axis=0)
+
+
+def get_band_ratios(psds, nfreqs, freq_bands):
+    """Compute the band powers, engagement and workload of all epochs.
+
+    All bands of freq_bands (theta, alpha, beta, gamma) are averaged with a
+    single matrix product, so the whole PSD tensor is reduced in one pass.
+    The engagement and workload are equal to the ones of
+    get_engagement_workload up to floating point rounding.
+
+    Parameters
+    ----------
+    psds : array, shape (..., n_freqs)
+        Power spectral density, e.g. of shape (n_epochs, n_channels,
+        n_freqs).
+    nfreqs : array, shape (n_freqs, )
+        Frequencies of the PSD.
+    freq_bands : list of lists
+        Lower and upper (inclusive) frequency of each band.
+
+    Returns
+    -------
+    band_ratios : dict
+        Band powers of shape (..., n_bands), engagement and workload of
+        shape (...).
+    """
+    band_powers = psds @ get_band_matrix(nfreqs, freq_bands)
+    theta, alpha, beta = (band_powers[..., i] for i in range(3))
+    return dict(band_powers=band_powers,
+                engagement=beta / (alpha + theta),
+                workload=theta / alpha)
+
+
+def compute_eeg_psd(raw, config, picks=None, subject=None):
+    """Compute the PSD of all epochs.
+
+    The recording is cut into epochs of config['epoch_length'] seconds
+    overlapping by config['overlap']. The PSD of the epochs is computed with
+    the method config['psd_method'] ('multitaper' or 'welch').
+
+    With config['artifact_rejection'], the bad channels and epochs are
+    found first (see features.artifacts.find_artifacts, the motion
+    criterion uses config['motion_channels'] if the recording has them).
+    Their PSD is not computed and left as NaN.
+
+    With config['psd_streaming'], the PSD is computed block by block and
+    written to the HDF5 interim store instead (see
+    compute_eeg_psd_streaming).
+
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        Raw EEG recording.
+    config : dict
+        Configuration dictionary.
+    picks : list of str | None
+        Channels to use. If None, all channels are used.
+    subject : str | None
+        Subject ID, only needed with config['psd_streaming'].
+
+    Returns
+    -------
+    psd : dict
+        PSD of each epoch (shape (n_epochs, n_channels, n_freqs)), its
+        frequencies, the channel names, the start time (in seconds) of
+        each epoch and the bad epochs and channels.
+    """
+    if config.get('psd_streaming', False):
+        return compute_eeg_psd_streaming(raw, config, subject, picks)
+    sfreq = raw.info['sfreq']
+    data = raw.get_data(picks=picks)
+    ch_names = picks if picks is not None else raw.ch_names
+    bad_epochs = np.zeros(get_n_epochs(data.shape[1], sfreq, config), bool)
+    bad_channels = np.zeros(len(data), bool)
+    if config.get('artifact_rejection', False):
+        with profile_stage('artifact_rejection'):
+            motion_channels = _get_motion_channels(raw, config)
+            motion = raw.get_data(
+                picks=motion_channels) if motion_channels else None
+            bad_epochs, bad_channels = find_artifacts(data, motion, sfreq,
+                                                      config)
+        _print_rejected(bad_epochs, bad_channels, ch_names)
+    # Calculate the psd values (epoching is a strided view, it is included)
+    with profile_stage('psd'):
+        psds, nfreqs = compute_psd(data,
+                                   sfreq,
+                                   config,
+                                   n_jobs=config.get('n_jobs', 6),
+                                   bad_epochs=bad_epochs,
+                                   bad_channels=bad_channels)
+    n_samples, step = get_epoch_step(sfreq, config)
+    return dict(psds=psds,
+                nfreqs=nfreqs,
+                ch_names=ch_names,
+                times=np.arange(len(psds)) * step / sfreq,
+                bad_epochs=bad_epochs,
+                bad_channels=bad_channels)
+
+
+def compute_eeg_psd_streaming(raw, config, subject, picks=None):
+    """Compute the PSD of all epochs within a fixed memory budget.
+
+    The samples are read block by block (see features.psd.iter_psd_blocks),
+    so that a block of epochs, its PSD and the working memory of the PSD
+    take about config['psd_memory_budget'] MB. The PSD of each block is
+    written to the HDF5 interim store (see save_psd_block) as soon as it is
+    computed. The stored PSD is identical to the one of compute_eeg_psd.
+    With config['raw_memmap'], the samples are also read from disk on
+    demand. With config['artifact_rejection'], a first pass over the
+    blocks collects the statistics of the epochs (see
+    features.artifacts.get_block_statistics) and the PSD of the bad
+    channels and epochs is left as NaN.
+
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        Raw EEG recording.
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+    picks : list of str | None
+        Channels to use. If None, all channels are used.
+
+    Returns
+    -------
+    psd : dict
+        Same as compute_eeg_psd, except that the PSD itself is left in the
+        store and the subject is given instead.
+    """
+    if subject is None:
+        raise ValueError('The subject is needed to store the PSD.')
+    sfreq = raw.info['sfreq']
+    ch_names = picks if picks is not None else raw.ch_names
+    n_epochs = get_n_epochs(raw.n_times, sfreq, config)
+    if n_epochs == 0:
+        raise ValueError(f'The recording of S_{subject} is shorter than an '
+                         'epoch.')
+
+    def read(start, stop):
+        return raw.get_data(picks=picks, start=start, stop=stop)
+
+    bad_epochs = np.zeros(n_epochs, bool)
+    bad_channels = np.zeros(len(ch_names), bool)
+    if config.get('artifact_rejection', False):
+        with profile_stage('artifact_rejection'):
+            motion_channels = _get_motion_channels(raw, config)
+
+            def read_motion(start, stop):
+                return raw.get_data(picks=motion_channels,
+                                    start=start,
+                                    stop=stop)
+
+            statistics = get_block_statistics(
+                read, read_motion if motion_channels else None, raw.n_times,
+                len(ch_names), sfreq, config)
+            bad_epochs, bad_channels = find_artifacts_from_statistics(
+                statistics, config)
+        _print_rejected(bad_epochs, bad_channels, ch_names)
+        if bad_epochs.all() or bad_channels.all():
+            raise ValueError('All epochs or channels are bad.')
+
+    with profile_stage('psd'):
+        for start, psds, nfreqs in iter_psd_blocks(read,
+                                                   raw.n_times,
+                                                   len(ch_names),
+                                                   sfreq,
+                                                   config,
+                                                   n_jobs=config.get(
+                                                       'n_jobs', 6),
+                                                   bad_epochs=bad_epochs,
+                                                   bad_channels=bad_channels):
+            save_psd_block(config, subject, start, psds, nfreqs, n_epochs)
+    n_samples, step = get_epoch_step(sfreq, config)
+    return dict(nfreqs=nfreqs,
+                ch_names=ch_names,
+                times=np.arange(n_epochs) * step / sfreq,
+                bad_epochs=bad_epochs,
+                bad_channels=bad_channels,
+                subject=subject)
+
+
+def _get_motion_channels(raw, config):
+    """Accelerometer channels of config['motion_channels'] in raw."""
+    return [ch for ch in config['motion_channels'] if ch in raw.ch_names]
+
+
+def _print_rejected(bad_epochs, bad_channels, ch_names):
+    print(f'Rejected {bad_epochs.sum()}/{len(bad_epochs)} epochs and '
+          f'{bad_channels.sum()}/{len(bad_channels)} channels '
+          f'{[ch for ch, bad in zip(ch_names, bad_channels) if bad]}')
+
+
+def compute_band_features(psd, config):
+    """Compute the band powers, engagement and workload from the PSD.
+
+    Parameters
+    ----------
+    psd : dict
+        PSD of the epochs as returned by compute_eeg_psd. If it holds no
+        PSD (see compute_eeg_psd_streaming), the PSD is read from the store
+        block by block.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    features : dict
+        Engagement and workload (both of shape (n_epochs, n_channels)), the
+        power of each frequency band (shape (n_epochs, n_channels,
+        n_bands)), the channel names, the start time (in seconds) of each
+        epoch and the bad epochs and channels (whose features are NaN).
+    """
+    with profile_stage('band_ratios'):
+        if 'psds' in psd:
+            band_ratios = get_band_ratios(psd['psds'], psd['nfreqs'],
+                                          config['freq_bands'])
+        else:
+            blocks = [
+                get_band_ratios(psds, psd['nfreqs'], config['freq_bands'])
+                for psds in load_psd_blocks(config, psd['subject'])
+            ]
+            band_ratios = {
+                name: np.concatenate([block[name] for block in blocks])
+                for name in blocks[0]
+            }
+    return dict(**band_ratios,
+                ch_names=psd['ch_names'],
+                times=psd['times'],
+                bad_epochs=psd['bad_epochs'],
+                bad_channels=psd['bad_channels'])
+
+
+def compute_eeg_features(raw, config, picks=None, subject=None):
+    """Compute the engagement and workload of all epochs.
+
+    See compute_eeg_psd and compute_band_features.
+    """
+    return compute_band_features(compute_eeg_psd(raw, config, picks, subject),
+                                 config)
+
+
+def get_xdf_path(config, subject):
+    """Path of the XDF recording of a subject."""
+    return config['raw_eeg_path'] + 'S_' + subject + '/eeg.xdf'
 
+
+def _prepare_raw(raw, config):
+    """Drop the unused channels and set the channel types and montage."""
+    raw = raw.drop_channels(config['drop_channels'])
+    raw.set_channel_types({
+        ch: 'misc'
+        for ch in config['motion_channels'] if ch in raw.ch_names
+    })
+    raw.set_montage(montage=config['montage'], verbose=False)
+    return raw
+
+
+def read_raw_eeg(config, subject):
+    """Read the raw EEG of a subject, from the interim store if possible.
+
+    The recording (after dropping the unused channels, setting the type of
+    config['motion_channels'] to misc and setting the montage) is cached in
+    the HDF5 file config['raw_eeg_data']. The cache is invalidated when the
+    XDF file or the relevant config keys change.
+
+    With config['raw_memmap'], the recording is instead decoded once into a
+    memory-mapped file next to the HDF5 file and read from it on demand.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+
+    Returns
+    -------
+    raw : mne.io.Raw
+        Raw EEG recording.
+    """
+    read_path = get_xdf_path(config, subject)
+    if config['raw_memmap']:
+        # RawMemmap subclasses an MNE class, import it only when used
+        from .raw_memmap import read_raw_xdf_memmap
+
+        dtype = config['memmap_dtype']
+        memmap_path = Path(config['raw_eeg_data']).with_name(
+            'S_' + subject + f'_eeg_{dtype}.dat')
+        raw = read_raw_xdf_memmap(read_path, memmap_path, dtype=dtype)
+        return _prepare_raw(raw, config)
+
+    key = raw_cache_key(config, read_path)
+    raw = load_raw(config, subject, key=key)
+    if raw is None:
+        raw = read_raw_xdf(read_path)
+        raw = _prepare_raw(raw, config)
+        save_raw(config, subject, raw, key)
     return raw
 
 
+def read_xdf_eeg_data(config, subject):
+    with profile_stage('read_raw_xdf', subject=subject):
+        raw = read_raw_eeg(config, subject)
+    with profile_stage('feature_extraction', subject=subject):
+        features = compute_eeg_features(raw,
+                                        config,
+                                        picks=EEG_CH_NAMES,
+                                        subject=subject)
+    with profile_stage('save_features', subject=subject):
+        save_features(config, subject, features)
+
+    return dict(raw=raw, features=features)
+
+
+def _init_worker(lock):
+    """Initialize a worker process of create_eeg_data."""
+    set_store_lock(lock)
+    reset_profiling()
+
+
+def get_worker_config(config, n_workers):
+    """Configuration of a worker process, sharing config['n_jobs'].
+
+    The FFT jobs of the multitaper PSD are split between the n_workers
+    processes, so that they do not oversubscribe the CPU cores.
+    """
+    return dict(config, n_jobs=max(config.get('n_jobs', 6) // n_workers, 1))
+
+
+def _read_subject(config, subject):
+    """Process a subject in a worker, returning its stage records too.
+
+    Only the features are sent back, the raw recording stays in the worker
+    (and in the interim store).
+    """
+    features = read_xdf_eeg_data(config, subject)['features']
+    return dict(features=features), pop_profile_records()
+
+
 def create_eeg_data(config):
-    plt.rcParams.update({'font.size': 22})
+    """Read and process the EEG data of all subjects.
+
+    With config['n_workers'] > 1 the subjects are processed in parallel by a
+    pool of processes, sharing the config['n_jobs'] FFT jobs of the PSD
+    (see get_worker_config). A subject whose processing fails is logged and
+    left out of the result, the remaining subjects are still processed. The
+    stages of each subject are recorded (see utils.profile_stage), also
+    when they run in a worker.
+
+    Under the spawn and forkserver start methods (the default on macOS and
+    Windows, and on Linux from Python 3.14) the workers import the main
+    module again, so the pool must be started from a script guarded by
+    `if __name__ == '__main__':` (see main.py).
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    eeg_data : dict
+        Processed EEG data of each subject, keyed by 'S_<subject>': the
+        features and, without workers, the raw recording.
+    """
     eeg_data = collections.defaultdict(dict)
-    for subject in config['subjects']:
-        eeg_data['S_' + subject] = read_xdf_eeg_data(config, subject)
-    return None
+    subjects = config['subjects']
+    n_workers = min(config.get('n_workers', 1), len(subjects))
+    if n_workers <= 1:
+        for i, subject in enumerate(subjects):
+            try:
+                eeg_data['S_' + subject] = read_xdf_eeg_data(config, subject)
+            except Exception:
+                logger.exception(f'Failed to process subject S_{subject}')
+                continue
+            print(f'Processed S_{subject} ({i + 1}/{len(subjects)})')
+        return eeg_data
+
+    worker_config = get_worker_config(config, n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_worker,
+                             initargs=(multiprocessing.Lock(), )) as executor:
+        futures = {
+            executor.submit(_read_subject, worker_config, subject): subject
+            for subject in subjects
+        }
+        for i, future in enumerate(as_completed(futures)):
+            subject = futures[future]
+            try:
+                eeg_data['S_' + subject], records = future.result()
+                add_profile_records(records)
+            except Exception:
+                logger.exception(f'Failed to process subject S_{subject}')
+                continue
+            print(f'Processed S_{subject} ({i + 1}/{len(subjects)})')
+    return eeg_data
+
+
+def _xdf_files(config, subject):
+    return [get_xdf_path(config, subject)]
+
+
+def _compute_psd(config, subject, raw):
+    return compute_eeg_psd(raw, config, picks=EEG_CH_NAMES, subject=subject)
+
+
+def _psd_stored(config, subject, psd):
+    # with config['psd_streaming'] the PSD itself is in the interim store
+    if 'psds' in psd:
+        return True
+    shape = (len(psd['times']), len(psd['ch_names']), len(psd['nfreqs']))
+    return get_psd_shape(config, subject) == shape
+
+
+def _save_features(config, subject, psd):
+    features = compute_band_features(psd, config)
+    save_features(config, subject, features)
+    return features
+
+
+# stages of the EEG feature pipeline, see pipeline.run_pipeline (their
+# functions are defined at module level, so that workers can unpickle them)
+EEG_STAGES = [
+    Stage('raw',
+          read_raw_eeg,
+          config_keys=['drop_channels', 'motion_channels', 'montage',
+                       'raw_memmap', 'memmap_dtype'],
+          files=_xdf_files,
+          persist=False),
+    Stage('psd',
+          _compute_psd,
+          inputs=['raw'],
+          # the memory budget does not change the result
+          config_keys=['epoch_length', 'overlap', 'psd_method',
+                       'multitaper_bandwidth', 'welch_segment_length',
+                       'psd_streaming', 'raw_eeg_data',
+                       'artifact_rejection', 'motion_channels', 'reject_ptp',
+                       'flat_ptp', 'reject_motion_z', 'bad_channel_z',
+                       'bad_channel_fraction'],
+          check=_psd_stored),
+    Stage('features',
+          _save_features,
+          inputs=['psd'],
+          config_keys=['freq_bands', 'raw_eeg_data']),
+]
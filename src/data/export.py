@@ -0,0 +1,139 @@
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from .utils import load_features
+
+# names of the bands of config['freq_bands']
+BAND_NAMES = ['theta', 'alpha', 'beta', 'gamma']
+
+# per-epoch features exported, all of shape (n_epochs, n_channels, ...)
+EXPORT_COLUMNS = ['engagement', 'workload', 'band_powers']
+
+
+def export_features(config, fname=None, subjects=None):
+    """Export the features of all subjects as a chunked HDF5 dataset.
+
+    Each subject is a group 'S_<subject>' holding one dataset per feature
+    (engagement, workload and band powers, see EXPORT_COLUMNS), the time
+    index (start of each epoch, in seconds), the bad epochs and channels
+    (see features.artifacts.find_artifacts) and the channel names. The
+    features are chunked by config['export_chunk_duration'] seconds of
+    epochs and by channel, and compressed, so that reading a few channels
+    over a time window (see read_exported_features) only decompresses the
+    chunks overlapping it. Subjects are read from the interim store one at
+    a time.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    fname : str | None
+        Name of the exported file, config['features_export_path'] if None.
+    subjects : list of str | None
+        Subjects to export, config['subjects'] if None.
+
+    Returns
+    -------
+    fname : str
+        Name of the exported file.
+    """
+    fname = Path(fname or config['features_export_path'])
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    subjects = config['subjects'] if subjects is None else subjects
+    with h5py.File(fname, 'w') as f:
+        f.attrs['band_names'] = BAND_NAMES[:len(config['freq_bands'])]
+        f.attrs['freq_bands'] = np.asarray(config['freq_bands'], dtype=float)
+        for subject in subjects:
+            features = load_features(config, subject)
+            if features is None:
+                raise ValueError(f'No features stored for subject S_{subject}')
+            times = features['times']
+            step = times[1] - times[0] if len(times) > 1 else 1.0
+            n_chunk = int(max(config['export_chunk_duration'] // step, 1))
+            group = f.create_group('S_' + subject)
+            group.attrs['ch_names'] = features['ch_names']
+            group.create_dataset('times', data=times)
+            n_epochs, n_channels = features['engagement'].shape
+            group.create_dataset(
+                'bad_epochs',
+                data=features.get('bad_epochs', np.zeros(n_epochs, bool)))
+            group.create_dataset(
+                'bad_channels',
+                data=features.get('bad_channels', np.zeros(n_channels, bool)))
+            for name in EXPORT_COLUMNS:
+                value = features[name]
+                group.create_dataset(name,
+                                     data=value,
+                                     chunks=(min(n_chunk, max(len(value), 1)),
+                                             1) + value.shape[2:],
+                                     compression='gzip',
+                                     compression_opts=4,
+                                     shuffle=True)
+    return str(fname)
+
+
+def read_exported_features(fname,
+                           subject,
+                           channels=None,
+                           bands=None,
+                           tmin=None,
+                           tmax=None,
+                           columns=None):
+    """Read a selection of the features exported with export_features.
+
+    Only the epochs starting in [tmin, tmax] (found by a binary search of
+    the time index) and the selected channels are read, so only the
+    chunks holding them are decompressed.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the exported file.
+    subject : str
+        Subject ID.
+    channels : list of str | None
+        Channels to read, all if None.
+    bands : list of str | None
+        Bands of the band powers to read (see BAND_NAMES), all if None.
+    tmin : float | None
+        Start of the time window (in seconds).
+    tmax : float | None
+        End of the time window (in seconds).
+    columns : list of str | None
+        Features to read (see EXPORT_COLUMNS), all if None.
+
+    Returns
+    -------
+    features : dict
+        The selected features, the start time of the selected epochs, the
+        selected bad epochs and channels and the selected channel and band
+        names (in the order of the file).
+    """
+    columns = EXPORT_COLUMNS if columns is None else columns
+    with h5py.File(fname, 'r') as f:
+        group = f['S_' + subject]
+        ch_names = list(group.attrs['ch_names'])
+        band_names = list(f.attrs['band_names'])
+        # h5py selections have to be increasing
+        ch_idx = slice(None) if channels is None else np.sort(
+            [ch_names.index(ch) for ch in channels])
+        band_idx = np.arange(len(band_names)) if bands is None else np.sort(
+            [band_names.index(band) for band in bands])
+
+        times = group['times'][()]
+        start = 0 if tmin is None else np.searchsorted(times, tmin, 'left')
+        stop = len(times) if tmax is None else np.searchsorted(
+            times, tmax, 'right')
+        features = dict(times=times[start:stop],
+                        bad_epochs=group['bad_epochs'][start:stop],
+                        bad_channels=group['bad_channels'][()][ch_idx],
+                        ch_names=np.array(ch_names)[ch_idx].tolist(),
+                        band_names=[band_names[i] for i in band_idx])
+        for name in columns:
+            value = group[name][start:stop, ch_idx]
+            if name == 'band_powers':
+                value = value[..., band_idx]
+            features[name] = value
+    return features
@@ -1,21 +1,61 @@
+import collections
 import gzip
+import io
 import logging
+import os
 import struct
+import zipfile
 import xml.etree.ElementTree as ET
+from collections.abc import Hashable
 from pathlib import Path
 
-import mne
 import numpy as np
-from pyxdf import load_xdf
+
+from .block_gzip import BlockGzipFile, is_block_gzip
 
 logger = logging.getLogger()
 
+# mne is imported by the functions creating MNE objects, so that reading
+# the chunk index and the streams does not pay for importing it
+
+# numpy data types of the XDF channel formats (all numbers are little endian)
+_FORMATS = {
+    "int8": "<i1",
+    "int16": "<i2",
+    "int32": "<i4",
+    "int64": "<i8",
+    "float32": "<f4",
+    "double64": "<f8",
+    "string": object,
+}
+
+# one record per chunk, see build_index (ClockOffset chunks store their
+# collection time in "first_time" and their offset value in "last_time")
+INDEX_DTYPE = np.dtype([
+    ("tag", "<u2"),
+    ("stream_id", "<u4"),
+    ("offset", "<u8"),
+    ("nbytes", "<u8"),
+    ("n_samples", "<u8"),
+    ("first_time", "<f8"),
+    ("last_time", "<f8"),
+])
+INDEX_VERSION = 2
+
 
 def open_xdf(filename):
-    """Open XDF file for reading."""
+    """Open XDF file for reading.
+
+    Compressed files written by block_gzip.compress_xdf are opened with
+    random access and parallel decompression, other compressed files are
+    read with gzip.
+    """
     filename = Path(filename)  # convert to pathlib object
     if filename.suffix == '.xdfz' or filename.suffixes == ['.xdf', '.gz']:
-        f = gzip.open(filename, 'rb')
+        if is_block_gzip(filename):
+            f = io.BufferedReader(BlockGzipFile(filename))
+        else:
+            f = gzip.open(filename, 'rb')
     else:
         f = open(filename, 'rb')
     if f.read(4) != b'XDF:':  # magic bytes
@@ -38,18 +78,37 @@ def match_streaminfos(stream_infos, parameters):
                   [{"name": "Keyboard"}, {"type": "EEG"}] matches all streams
                   with a "name" field equal to "Keyboard" and all streams with
                   a "type" field equal to "EEG".
+                  [{}] matches all streams.
+
+    Returns
+    -------
+    stream_ids : list of int
+        Sorted IDs of the matching streams.
     """
-    matches = []
+    lookup = _index_streaminfos(stream_infos)
+    stream_ids = {info["stream_id"] for info in stream_infos}
+    matches = set()
     for request in parameters:
-        for info in stream_infos:
-            for key in request.keys():
-                match = info[key] == request[key]
-                if not match:
-                    break
-            if match:
-                matches.append(info['stream_id'])
+        matches |= _match_request(lookup, stream_ids, request)
+    return sorted(matches)
+
+
+def _index_streaminfos(stream_infos):
+    """Map each (key, value) pair of the stream infos to the stream IDs."""
+    lookup = collections.defaultdict(set)
+    for info in stream_infos:
+        for key, value in info.items():
+            if isinstance(value, Hashable):
+                lookup[key, value].add(info["stream_id"])
+    return lookup
+
 
-    return list(set(matches))  # return unique values
+def _match_request(lookup, stream_ids, request):
+    """IDs of the streams with all key/values of request (all if empty)."""
+    matches = set(stream_ids)
+    for key, value in request.items():
+        matches &= lookup.get((key, value), set())
+    return matches
 
 
 def resolve_streams(fname):
@@ -65,7 +124,8 @@ def resolve_streams(fname):
     stream_infos : list of dicts
         List of dicts containing information on each stream.
     """
-    return parse_chunks(parse_xdf(fname))
+    index, streams = load_index(fname)
+    return streams
 
 
 def parse_xdf(fname):
@@ -100,30 +160,77 @@ def _read_chunks(f):
     Yields
     ------
     chunk : dict
-        XDF chunk.
+        XDF chunk. The key "offset" holds the file position of the chunk tag,
+        so that the chunk contents can be revisited with f.seek. The file is
+        left after the parsed part of the chunk, the remaining contents are
+        skipped when the next chunk is read, so that callers can read them
+        without seeking backwards (which is slow on compressed files). A
+        truncated file (e.g. an interrupted recording) is read up to its
+        last complete chunk.
     """
+    size = _file_size(f)
+    offset = end = f.tell()
     while True:
-        chunk = dict()
         try:
-            chunk["nbytes"] = _read_varlen_int(f)
+            f.seek(end)  # skip remaining contents of the previous chunk
+        except EOFError:  # compressed file ending inside the previous chunk
+            _warn_truncated(offset)
+            return
+        try:
+            nbytes = _read_varlen_int(f)
         except EOFError:
             return
-        chunk["tag"] = struct.unpack('<H', f.read(2))[0]
-        if chunk["tag"] in [2, 3, 4, 6]:
-            chunk["stream_id"] = struct.unpack("<I", f.read(4))[0]
-            if chunk["tag"] == 2:  # parse StreamHeader chunk
-                xml = ET.fromstring(f.read(chunk["nbytes"] - 6).decode())
-                chunk = {**chunk, **_parse_streamheader(xml)}
-            else:  # skip remaining chunk contents
-                f.seek(chunk["nbytes"] - 6, 1)
-        else:
-            f.seek(chunk["nbytes"] - 2, 1)  # skip remaining chunk contents
+        except struct.error:  # truncated chunk length
+            _warn_truncated(end)
+            return
+        offset = f.tell()
+        end = offset + nbytes
+        if size is not None and end > size:
+            _warn_truncated(offset)
+            return
+        try:
+            chunk = _read_chunk_header(f, offset, nbytes)
+        except (struct.error, EOFError, UnicodeDecodeError, ET.ParseError):
+            _warn_truncated(offset)
+            return
         yield chunk
 
 
+def _read_chunk_header(f, offset, nbytes):
+    """Read the tag and the header fields of the chunk at offset."""
+    chunk = dict(nbytes=nbytes, offset=offset)
+    chunk["tag"] = struct.unpack('<H', f.read(2))[0]
+    if chunk["tag"] in [2, 3, 4, 6]:
+        chunk["stream_id"] = struct.unpack("<I", f.read(4))[0]
+        if chunk["tag"] == 2:  # parse StreamHeader chunk
+            chunk["xml"] = f.read(chunk["nbytes"] - 6).decode()
+            xml = ET.fromstring(chunk["xml"])
+            chunk = {**chunk, **_parse_streamheader(xml)}
+        elif chunk["tag"] == 3:  # sample count is needed for allocation
+            chunk["n_samples"] = _read_varlen_int(f)
+    return chunk
+
+
+def _file_size(f):
+    """Size of an uncompressed XDF file, None for compressed files."""
+    if isinstance(getattr(f, "raw", None), io.FileIO):
+        return os.fstat(f.fileno()).st_size
+    return None
+
+
+def _warn_truncated(offset):
+    """Log that an XDF file is read up to the chunk at offset."""
+    logger.warning(f"Truncated XDF file, ignoring the chunk at byte {offset} "
+                   "and the following data.")
+
+
 def _parse_streamheader(xml):
     """Parse stream header XML."""
-    return {el.tag: el.text for el in xml if el.tag != "desc"}
+    header = {el.tag: el.text for el in xml if el.tag != "desc"}
+    header["channels"] = [{el.tag: el.text
+                           for el in channel}
+                          for channel in xml.findall("desc/channels/channel")]
+    return header
 
 
 def parse_chunks(chunks):
@@ -143,95 +250,452 @@ def parse_chunks(chunks):
                     hostname=chunk.get("hostname"),  # optional
                     channel_count=int(chunk["channel_count"]),
                     channel_format=chunk["channel_format"],
-                    nominal_srate=int(chunk["nominal_srate"])))
+                    nominal_srate=float(chunk["nominal_srate"]),
+                    channels=chunk.get("channels", [])))
     return streams
 
 
-def read_raw_xdf(fname, stream_id=None):
+def load_index(fname):
+    """Load the chunk index of an XDF file.
+
+    The index is stored next to the XDF file (with the suffix ".index.npz")
+    and is rebuilt whenever the size or modification time of the XDF file
+    changed, or when the stored index cannot be read.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+
+    Returns
+    -------
+    index : ndarray
+        Structured array with one record per chunk (see INDEX_DTYPE).
+    streams : list of dicts
+        List of dicts containing information on each stream.
+    """
+    stat = Path(fname).stat()
+    index_fname = _index_fname(fname)
+    if index_fname.exists():
+        try:
+            with np.load(index_fname, allow_pickle=False) as stored:
+                if (stored["version"] == INDEX_VERSION
+                        and stored["size"] == stat.st_size
+                        and stored["mtime"] == stat.st_mtime_ns):
+                    index = stored["index"]
+                    return index, _parse_headers(index, stored["headers"])
+        except (zipfile.BadZipFile, OSError, KeyError, ValueError) as error:
+            # e.g. an interrupted write, the index is rebuilt
+            logger.warning(f"Could not read the XDF index {index_fname}: "
+                           f"{error}")
+
+    index, headers = build_index(fname)
+    # written under a temporary name (unique to the process) and renamed
+    # when complete, so that readers never see a partial file
+    temp_fname = index_fname.with_name(f"{index_fname.name}.{os.getpid()}"
+                                       ".tmp")
+    try:
+        with open(temp_fname, "wb") as f:
+            np.savez(f,
+                     index=index,
+                     headers=np.array(headers, dtype=str),
+                     size=stat.st_size,
+                     mtime=stat.st_mtime_ns,
+                     version=INDEX_VERSION)
+        os.replace(temp_fname, index_fname)
+    except OSError as error:
+        logger.warning(f"Could not save the XDF index {index_fname}: {error}")
+        temp_fname.unlink(missing_ok=True)
+    return index, _parse_headers(index, headers)
+
+
+def build_index(fname):
+    """Index all chunks of an XDF file in a single pass.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+
+    Returns
+    -------
+    index : ndarray
+        Structured array with the tag, stream ID, byte offset (of the chunk
+        tag), size, number of samples and first/last time stamp of each
+        chunk. Missing time stamps are deduced from the nominal sampling
+        rate. ClockOffset chunks hold their collection time and offset value
+        instead, time stamps of other chunks are NaN.
+    headers : list of str
+        XML of the stream header chunks.
+    """
+    records, headers, streams, last_times = [], [], {}, {}
+    with open_xdf(fname) as f:
+        for chunk in _read_chunks(f):
+            first_time = last_time = np.nan
+            if chunk["tag"] == 2:
+                headers.append(chunk["xml"])
+                streams[chunk["stream_id"]] = parse_chunks([chunk])[0]
+            elif chunk["tag"] == 3:
+                stream = streams[chunk["stream_id"]]
+                srate = stream["nominal_srate"]
+                tdiff = 1 / srate if srate > 0 else 0
+                previous = last_times.get(chunk["stream_id"], 0)
+                try:
+                    first, last = _read_time_range(f, chunk, stream)
+                except (struct.error, EOFError):  # truncated compressed file
+                    _warn_truncated(chunk["offset"])
+                    break
+                first_time = (first[1] if first[0] == 0 else previous + tdiff)
+                if last[0] is None:
+                    last_time = previous + chunk["n_samples"] * tdiff
+                else:
+                    last_time = (last[1] +
+                                 (chunk["n_samples"] - 1 - last[0]) * tdiff)
+                last_times[chunk["stream_id"]] = last_time
+            elif chunk["tag"] == 4:  # collection time and offset value
+                try:
+                    first_time, last_time = struct.unpack("<dd", f.read(16))
+                except struct.error:
+                    _warn_truncated(chunk["offset"])
+                    break
+            records.append(
+                (chunk["tag"], chunk.get("stream_id", 0), chunk["offset"],
+                 chunk["nbytes"], chunk.get("n_samples", 0), first_time,
+                 last_time))
+    return np.array(records, dtype=INDEX_DTYPE), headers
+
+
+def _read_time_range(f, chunk, stream):
+    """Read the first and last time stamp of a samples chunk.
+
+    The file has to be positioned after the number of samples of the chunk.
+
+    Returns
+    -------
+    first, last : tuple
+        Sample position and value of the first and last time stamp in the
+        chunk, (None, None) if no sample has a time stamp.
+    """
+    n_samples = chunk["n_samples"]
+    start, end = f.tell(), chunk["offset"] + chunk["nbytes"]
+    if stream["channel_format"] != "string":
+        sample_size = (np.dtype(_FORMATS[stream["channel_format"]]).itemsize *
+                       stream["channel_count"])
+        if end - start == n_samples * (sample_size + 1):  # no time stamps
+            return (None, None), (None, None)
+        if end - start == n_samples * (sample_size + 9):  # all time stamps
+            f.seek(start + 1)
+            first = struct.unpack("<d", f.read(8))[0]
+            f.seek(end - sample_size - 8)
+            last = struct.unpack("<d", f.read(8))[0]
+            return (0, first), (n_samples - 1, last)
+
+    # mixed time stamps or string samples, walk through the samples
+    time_stamps = np.full(n_samples, np.nan)
+    time_series = np.empty((n_samples, stream["channel_count"]),
+                           dtype=_FORMATS[stream["channel_format"]])
+    _read_samples(f, time_series, time_stamps, end - start)
+    stamped = np.flatnonzero(~np.isnan(time_stamps))
+    if not len(stamped):
+        return (None, None), (None, None)
+    return ((stamped[0], time_stamps[stamped[0]]),
+            (stamped[-1], time_stamps[stamped[-1]]))
+
+
+def _index_fname(fname):
+    """Name of the index file of an XDF file."""
+    fname = Path(fname)
+    return fname.with_name(fname.name + ".index.npz")
+
+
+def _parse_headers(index, headers):
+    """Parse stored stream header XML into stream information."""
+    stream_ids = index["stream_id"][index["tag"] == 2]
+    chunks = []
+    for stream_id, xml in zip(stream_ids, headers):
+        chunks.append({
+            "tag": 2,
+            "stream_id": int(stream_id),
+            **_parse_streamheader(ET.fromstring(xml))
+        })
+    return parse_chunks(chunks)
+
+
+def read_raw_xdf(fname, stream_id=None, tmin=None, tmax=None):
     """Read XDF file.
 
+    Only the selected EEG stream and the first Markers stream are decoded,
+    all other streams are skipped without being read into memory.
+
     Parameters
     ----------
     fname : str
         Name of the XDF file.
-    stream_id : int | str | None
-        ID (number) or name of the stream to load (optional). If None, the
-        first stream of type "EEG" will be read.
+    stream_id : int | str | dict | None
+        ID (number), name or criteria (e.g. {"type": "EEG", "name": "..."},
+        see match_streaminfos) of the stream to load (optional). If None,
+        the first stream of type "EEG" will be read.
+    tmin : float | None
+        Start time (in seconds, relative to the first sample of the stream)
+        of the data to read. If None, the data is read from the start.
+    tmax : float | None
+        End time (in seconds, relative to the first sample of the stream) of
+        the data to read. If None, the data is read until the end.
 
     Returns
     -------
     raw : mne.io.Raw
         XDF file data.
+
+    Raises
+    ------
+    ValueError
+        If no sample of the stream lies between tmin and tmax.
     """
-    streams, header = load_xdf(fname)
+    import mne
 
-    if stream_id is not None:
-        if isinstance(stream_id, str):
-            stream = _find_stream_by_name(streams, stream_id)
-        elif isinstance(stream_id, int):
-            stream = _find_stream_by_id(streams, stream_id)
-    else:
-        stream = _find_stream_by_type(streams, stream_type="EEG")
-
-    if stream is not None:
-        name = stream["info"]["name"][0]
-        n_chans = int(stream["info"]["channel_count"][0])
-        fs = float(stream["info"]["nominal_srate"][0])
-        logger.info(f"Found EEG stream '{name}' ({n_chans} channels, "
-                    f"sampling rate {fs}Hz).")
-        labels, types, units = _get_ch_info(stream)
-        if not labels:
-            labels = [str(n) for n in range(n_chans)]
-        if not units:
-            units = ["NA" for _ in range(n_chans)]
-        info = mne.create_info(ch_names=labels, sfreq=fs, ch_types="eeg")
-        # convert from microvolts to volts if necessary
-        scale = np.array([1e-6 if u == "microvolts" else 1 for u in units])
-        raw = mne.io.RawArray((stream["time_series"] * scale).T, info)
-        first_samp = stream["time_stamps"][0]
-    else:
+    index, streams = load_index(fname)
+    stream = _select_stream(streams, stream_id)
+    if stream is None:
         logger.info("No EEG stream found.")
         return
 
+    # convert the time range to absolute time stamps
+    samples = index[(index["tag"] == 3)
+                    & (index["stream_id"] == stream["stream_id"])]
+    start_time = samples["first_time"][0] if len(samples) else 0
+    start = None if tmin is None else start_time + tmin
+    stop = None if tmax is None else start_time + tmax
+
     markers = _find_stream_by_type(streams, stream_type="Markers")
+    with open_xdf(fname) as f:
+        stream = read_stream(f, index, stream, start, stop)
+        if markers is not None:
+            markers = read_stream(f, index, markers, start, stop)
+
+    if not len(stream["time_stamps"]):
+        duration = (np.nanmax(samples["last_time"]) -
+                    start_time if len(samples) else 0)
+        raise ValueError(f"No samples between tmin={tmin} and tmax={tmax}, "
+                         f"the recording spans 0 to {duration:.3f} s.")
+
+    info, scale = _create_info(stream["info"])
+    raw = mne.io.RawArray((stream["time_series"] * scale).T, info)
+
     if markers is not None:
-        onsets = markers["time_stamps"] - first_samp
-        logger.info(f"Adding {len(onsets)} annotations.")
-        descriptions = markers["time_series"]
-        annotations = mne.Annotations(onsets, [0] * len(onsets), descriptions)
-        raw.set_annotations(annotations)
+        raw.set_annotations(
+            _create_annotations(markers, stream["time_stamps"][0]))
 
     return raw
 
 
+def _create_info(stream):
+    """Create the measurement info of an EEG stream.
+
+    Returns
+    -------
+    info : mne.Info
+        Measurement info.
+    scale : array, shape (n_channels, )
+        Factor converting each channel to volts.
+    """
+    import mne
+
+    name = stream["name"]
+    n_chans = stream["channel_count"]
+    fs = stream["nominal_srate"]
+    logger.info(f"Found EEG stream '{name}' ({n_chans} channels, "
+                f"sampling rate {fs}Hz).")
+    labels, types, units = _get_ch_info(dict(info=stream))
+    if not labels:
+        labels = [str(n) for n in range(n_chans)]
+    if not units:
+        units = ["NA" for _ in range(n_chans)]
+    info = mne.create_info(ch_names=labels, sfreq=fs, ch_types="eeg")
+    # convert from microvolts to volts if necessary
+    scale = np.array([1e-6 if u == "microvolts" else 1 for u in units])
+    return info, scale
+
+
+def _create_annotations(markers, first_samp):
+    """Create annotations from a Markers stream."""
+    import mne
+
+    onsets = markers["time_stamps"] - first_samp
+    logger.info(f"Adding {len(onsets)} annotations.")
+    descriptions = markers["time_series"][:, 0]
+    return mne.Annotations(onsets, [0] * len(onsets), descriptions)
+
+
+def read_stream(f, index, stream, tmin=None, tmax=None):
+    """Decode the samples of a single stream.
+
+    Only the sample chunks of the requested stream (and time range) are
+    read, the file is positioned on each of them with f.seek. Numeric
+    samples are decoded straight into a preallocated array.
+
+    Parameters
+    ----------
+    f : file handle
+        File handle of XDF file.
+    index : ndarray
+        Chunk index of the XDF file as returned by load_index.
+    stream : dict
+        Stream information as returned by resolve_streams.
+    tmin : float | None
+        First time stamp to read. If None, the data is read from the start.
+    tmax : float | None
+        Last time stamp to read. If None, the data is read until the end.
+
+    Returns
+    -------
+    stream : dict
+        Dict with the stream information ("info"), the samples
+        ("time_series", shape (n_samples, n_channels)) and their time stamps
+        ("time_stamps").
+    """
+    selected = ((index["tag"] == 3)
+                & (index["stream_id"] == stream["stream_id"]))
+    if tmin is not None:
+        selected &= index["last_time"] >= tmin
+    if tmax is not None:
+        selected &= index["first_time"] <= tmax
+    sample_chunks = index[selected]
+    n_samples = int(sample_chunks["n_samples"].sum())
+    n_chans = stream["channel_count"]
+    dtype = _FORMATS[stream["channel_format"]]
+
+    time_series = np.empty((n_samples, n_chans), dtype=dtype)
+    time_stamps = np.full(n_samples, np.nan)
+    start = 0
+    for chunk in sample_chunks:
+        f.seek(int(chunk["offset"]) + 6)  # skip tag and stream ID
+        _read_varlen_int(f)  # number of samples, already known
+        stop = start + int(chunk["n_samples"])
+        nbytes = int(chunk["offset"] + chunk["nbytes"]) - f.tell()
+        try:
+            _read_samples(f, time_series[start:stop],
+                          time_stamps[start:stop], nbytes)
+        except EOFError:  # compressed file ending inside the chunk
+            _warn_truncated(chunk["offset"])
+            n_samples = start
+            time_series, time_stamps = time_series[:start], time_stamps[:start]
+            break
+        if stop > start and np.isnan(time_stamps[start]):
+            time_stamps[start] = chunk["first_time"]
+        start = stop
+
+    time_stamps = _fill_time_stamps(time_stamps, stream["nominal_srate"])
+    if tmin is not None or tmax is not None:
+        keep = np.ones(n_samples, dtype=bool)
+        if tmin is not None:
+            keep &= time_stamps >= tmin
+        if tmax is not None:
+            keep &= time_stamps <= tmax
+        time_series, time_stamps = time_series[keep], time_stamps[keep]
+    return dict(info=stream, time_series=time_series, time_stamps=time_stamps)
+
+
+def _read_samples(f, time_series, time_stamps, nbytes):
+    """Read the samples of a samples chunk into the given arrays.
+
+    The sample data (nbytes bytes) is read at once. Numeric samples that all
+    have a time stamp, or all have none, have a fixed size and are decoded
+    with a single np.frombuffer, other chunks sample by sample.
+    """
+    buffer = bytearray(nbytes)
+    if f.readinto(buffer) != nbytes:
+        raise EOFError(f"Truncated samples chunk, expected {nbytes} bytes.")
+    if time_series.dtype != object:
+        n_samples, n_chans = time_series.shape
+        for flag in [8, 0]:
+            layout = _sample_layout(time_series.dtype, n_chans, flag)
+            if nbytes != n_samples * layout.itemsize:
+                continue
+            samples = np.frombuffer(buffer, dtype=layout)
+            if (samples["flag"] == flag).all():
+                time_series[:] = samples["values"]
+                if flag:
+                    time_stamps[:] = samples["time_stamp"]
+                return
+    _read_samples_slow(io.BytesIO(buffer), time_series, time_stamps)
+
+
+def _sample_layout(dtype, n_chans, flag):
+    """Data type of a numeric sample with (flag 8) or without time stamp."""
+    fields = [("flag", "u1")]
+    if flag:
+        fields.append(("time_stamp", "<f8"))
+    fields.append(("values", dtype, (n_chans, )))
+    return np.dtype(fields)
+
+
+def _read_samples_slow(f, time_series, time_stamps):
+    """Read samples one by one (mixed time stamps or string samples)."""
+    for k in range(len(time_series)):
+        if f.read(1) == b'\x08':  # sample has a time stamp
+            time_stamps[k] = struct.unpack('<d', f.read(8))[0]
+        if time_series.dtype == object:
+            time_series[k] = [
+                f.read(_read_varlen_int(f)).decode()
+                for _ in range(time_series.shape[1])
+            ]
+        else:
+            f.readinto(time_series[k])
+
+
+def _fill_time_stamps(time_stamps, srate):
+    """Deduce missing time stamps from the nominal sampling rate."""
+    missing = np.isnan(time_stamps)
+    if not missing.any():
+        return time_stamps
+    tdiff = 1 / srate if srate > 0 else 0
+    index = np.arange(len(time_stamps))
+    last = np.maximum.accumulate(np.where(missing, -1, index))
+    previous = np.where(last >= 0, time_stamps[np.maximum(last, 0)], 0)
+    return np.where(missing, previous + (index - last) * tdiff, time_stamps)
+
+
+def _select_stream(streams, stream_id=None):
+    """Find a stream by ID, name or criteria, or the first EEG stream."""
+    if stream_id is None:
+        return _find_stream_by_type(streams, stream_type="EEG")
+    if isinstance(stream_id, dict):
+        matches = match_streaminfos(streams, [stream_id])
+        return _find_stream_by_id(streams, matches[0]) if matches else None
+    if isinstance(stream_id, str):
+        return _find_stream_by_name(streams, stream_id)
+    if isinstance(stream_id, int):
+        return _find_stream_by_id(streams, stream_id)
+
+
 def _find_stream_by_name(streams, stream_name):
     """Find the first stream that matches the given name."""
     for stream in streams:
-        if stream["info"]["name"][0] == stream_name:
+        if stream["name"] == stream_name:
             return stream
 
 
 def _find_stream_by_id(streams, stream_id):
     """Find the stream that matches the given ID."""
     for stream in streams:
-        if stream["info"]["stream_id"] == stream_id:
+        if stream["stream_id"] == stream_id:
             return stream
 
 
 def _find_stream_by_type(streams, stream_type="EEG"):
     """Find the first stream that matches the given type."""
     for stream in streams:
-        if stream["info"]["type"][0] == stream_type:
+        if stream["type"] == stream_type:
             return stream
 
 
 def _get_ch_info(stream):
     labels, types, units = [], [], []
-    if stream["info"]["desc"]:
-        for ch in stream["info"]["desc"][0]["channels"][0]["channel"]:
-            labels.append(str(ch["label"][0]))
-            types.append(ch["type"][0])
-            units.append(ch["unit"][0])
+    for ch in stream["info"]["channels"]:
+        labels.append(str(ch.get("label")))
+        types.append(ch.get("type"))
+        units.append(ch.get("unit"))
     return labels, types, units
 
 
@@ -239,7 +703,7 @@ def _read_varlen_int(f):
     """Read a variable-length integer."""
     nbytes = f.read(1)
     if nbytes == b'\x01':
-        return ord(f.read(1))
+        return struct.unpack('<B', f.read(1))[0]
     elif nbytes == b'\x04':
         return struct.unpack('<I', f.read(4))[0]
     elif nbytes == b'\x08':
@@ -0,0 +1,169 @@
+import os
+from pathlib import Path
+
+import numpy as np
+from mne.io import BaseRaw
+
+from .mne_import_xdf import (_FORMATS, _create_annotations, _create_info,
+                             _find_stream_by_type, _read_samples,
+                             _read_varlen_int, _select_stream, load_index,
+                             open_xdf, read_stream, logger)
+from .utils import file_hash
+
+
+class RawMemmap(BaseRaw):
+    """Raw data read on demand from a channel-major memory-mapped file.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the memory-mapped file, of shape (n_channels, n_times).
+    info : mne.Info
+        Measurement info.
+    n_times : int
+        Number of samples of the recording.
+    dtype : str
+        Data type of the memory-mapped file ('float32' or 'float64').
+    """
+    def __init__(self, fname, info, n_times, dtype='float32'):
+        raw_extras = dict(shape=(info['nchan'], n_times), dtype=dtype)
+        super(RawMemmap, self).__init__(
+            info,
+            preload=False,
+            last_samps=(n_times - 1, ),
+            filenames=(str(fname), ),
+            raw_extras=[raw_extras],
+            orig_format='single' if dtype == 'float32' else 'double',
+            verbose=False)
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        """Read a segment of data from the memory-mapped file."""
+        extras = self._raw_extras[fi]
+        memmap = np.memmap(self._filenames[fi],
+                           dtype=extras['dtype'],
+                           mode='r',
+                           shape=extras['shape'])
+        block = memmap[:, start:stop]
+        # the calibration of MNE's private _mult_cal_one, which moved between
+        # releases
+        if mult is not None:
+            data[:] = mult @ block[idx]
+        else:
+            data[:] = block[idx]
+            data *= cals.reshape(-1, 1)
+
+
+def read_raw_xdf_memmap(fname, memmap_fname, stream_id=None, dtype='float32'):
+    """Read an XDF file into a memory-mapped raw object.
+
+    The EEG stream is decoded once into memmap_fname, chunk by chunk, with
+    the samples stored channel-major and already scaled to volts. The hash
+    of the XDF file is written next to it (memmap_fname + '.key') and later
+    calls reuse the file as long as the hash matches, so reopening a
+    recording only costs hashing the file, reading the chunk index and the
+    markers.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+    memmap_fname : str
+        Name of the memory-mapped file holding the EEG samples.
+    stream_id : int | str | dict | None
+        ID (number), name or criteria (e.g. {"type": "EEG", "name": "..."},
+        see match_streaminfos) of the stream to load (optional). If None,
+        the first stream of type "EEG" will be read.
+    dtype : str
+        Data type of the memory-mapped file ('float32' or 'float64').
+
+    Returns
+    -------
+    raw : RawMemmap
+        XDF file data, read from memmap_fname on demand.
+    """
+    index, streams = load_index(fname)
+    stream = _select_stream(streams, stream_id)
+    if stream is None:
+        logger.info("No EEG stream found.")
+        return
+
+    chunks = index[(index["tag"] == 3)
+                   & (index["stream_id"] == stream["stream_id"])]
+    n_times = int(chunks["n_samples"].sum())
+    info, scale = _create_info(stream)
+    memmap_fname = Path(memmap_fname)
+    key_fname = memmap_fname.with_name(memmap_fname.name + '.key')
+    key = file_hash(fname)
+    stale = (not memmap_fname.exists() or not key_fname.exists()
+             or key_fname.read_text() != key)
+
+    markers = _find_stream_by_type(streams, stream_type="Markers")
+    with open_xdf(fname) as f:
+        if stale:
+            _decode_to_memmap(f, chunks, stream, scale, memmap_fname, dtype)
+            _write_atomic(key_fname, key.encode())
+        if markers is not None:
+            markers = read_stream(f, index, markers)
+
+    raw = RawMemmap(memmap_fname, info, n_times, dtype=dtype)
+    if markers is not None and len(chunks):
+        raw.set_annotations(
+            _create_annotations(markers, chunks["first_time"][0]))
+    return raw
+
+
+def _decode_to_memmap(f, chunks, stream, scale, memmap_fname, dtype):
+    """Decode the samples chunks of a stream into a memory-mapped file.
+
+    The file is written under a temporary name, unique to the process, and
+    renamed when complete, so an interrupted decoding never leaves a
+    valid-looking file behind and concurrent decodings do not collide.
+    """
+    memmap_fname.parent.mkdir(parents=True, exist_ok=True)
+    temp_fname = _temp_name(memmap_fname)
+    try:
+        _decode_chunks(f, chunks, stream, scale, temp_fname, dtype)
+        os.replace(temp_fname, memmap_fname)
+    except BaseException:
+        temp_fname.unlink(missing_ok=True)
+        raise
+
+
+def _decode_chunks(f, chunks, stream, scale, fname, dtype):
+    """Decode the samples chunks of a stream into a new memory-mapped file."""
+    n_chans = stream["channel_count"]
+    data = np.memmap(fname,
+                     dtype=dtype,
+                     mode='w+',
+                     shape=(n_chans, int(chunks["n_samples"].sum())))
+    start = 0
+    for chunk in chunks:
+        f.seek(int(chunk["offset"]) + 6)  # skip tag and stream ID
+        _read_varlen_int(f)  # number of samples, already known
+        n_samples = int(chunk["n_samples"])
+        samples = np.empty((n_samples, n_chans),
+                           dtype=_FORMATS[stream["channel_format"]])
+        nbytes = int(chunk["offset"] + chunk["nbytes"]) - f.tell()
+        _read_samples(f, samples, np.empty(n_samples), nbytes)
+        block = data[:, start:start + n_samples]
+        block[:] = samples.T
+        block *= scale[:, None].astype(dtype)
+        start += n_samples
+    data.flush()
+    del data
+
+
+def _temp_name(fname):
+    """Temporary name of a file being written by this process."""
+    return fname.with_name(f"{fname.name}.{os.getpid()}.tmp")
+
+
+def _write_atomic(fname, content):
+    """Write a small file under a temporary name and rename it."""
+    temp_fname = _temp_name(fname)
+    try:
+        temp_fname.write_bytes(content)
+        os.replace(temp_fname, fname)
+    except OSError:
+        temp_fname.unlink(missing_ok=True)
+        raise
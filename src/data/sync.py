@@ -0,0 +1,259 @@
+from pathlib import Path
+
+import numpy as np
+
+from .mne_import_xdf import _get_ch_info, load_index, open_xdf, read_stream
+
+
+def _fit_lines(groups, x, y):
+    """Least-squares line y = intercept + slope * x of each group of points.
+
+    All groups are fitted at once from per-group sums (np.bincount), so the
+    cost is linear in the number of points. Groups with a single distinct x
+    get a slope of 0.
+
+    Parameters
+    ----------
+    groups : array of int, shape (n_points, )
+        Group (0 to n_groups - 1) of each point.
+    x, y : array, shape (n_points, )
+        Coordinates of the points.
+
+    Returns
+    -------
+    intercept, slope : array, shape (n_groups, )
+        Coefficients of the line of each group.
+    """
+    count = np.bincount(groups)
+    x_mean = np.bincount(groups, x) / count
+    y_mean = np.bincount(groups, y) / count
+    dx = x - x_mean[groups]
+    sxx = np.bincount(groups, dx * dx)
+    sxy = np.bincount(groups, dx * (y - y_mean[groups]))
+    slope = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    return y_mean - slope * x_mean, slope
+
+
+def fit_clock_drift(index):
+    """Fit the clock offset of every stream as a linear function of time.
+
+    The ClockOffset chunks of all streams are taken from the chunk index and
+    fitted together with _fit_lines.
+
+    Parameters
+    ----------
+    index : ndarray
+        Chunk index of the XDF file as returned by load_index.
+
+    Returns
+    -------
+    drift : dict
+        (intercept, slope) of each stream ID, the time stamp t of a stream is
+        t + intercept + slope * t on the clock of the recording computer.
+    """
+    offsets = index[index["tag"] == 4]
+    if not len(offsets):
+        return {}
+    stream_ids, groups = np.unique(offsets["stream_id"], return_inverse=True)
+    intercept, slope = _fit_lines(groups, offsets["first_time"],
+                                  offsets["last_time"])
+    return {
+        int(stream_id): (intercept[i], slope[i])
+        for i, stream_id in enumerate(stream_ids)
+    }
+
+
+def dejitter_time_stamps(time_stamps, srate, max_gap=1.0, max_gap_samples=500):
+    """Replace the time stamps of a regular stream by a piecewise linear fit.
+
+    The stream is split into segments at gaps longer than max_gap seconds
+    (or max_gap_samples sample periods) and at time stamps going backwards,
+    and the time stamps of each segment are fitted by a line over the sample
+    number (as pyxdf does).
+
+    Parameters
+    ----------
+    time_stamps : array, shape (n_samples, )
+        Time stamps of the stream.
+    srate : float
+        Nominal sampling rate of the stream, streams with an irregular rate
+        (0) are returned unchanged.
+    max_gap : float
+        Minimum duration (in seconds) of a gap that starts a new segment.
+    max_gap_samples : int
+        Minimum duration (in sample periods) of a gap that starts a new
+        segment.
+
+    Returns
+    -------
+    time_stamps : array, shape (n_samples, )
+        Dejittered time stamps.
+    """
+    if srate <= 0 or len(time_stamps) < 2:
+        return time_stamps
+    diffs = np.diff(time_stamps)
+    breaks = (diffs < 0) | (diffs > max(max_gap, max_gap_samples / srate))
+    segments = np.concatenate(([0], np.cumsum(breaks)))
+    samples = np.arange(len(time_stamps), dtype=float)
+    intercept, slope = _fit_lines(segments, samples, time_stamps)
+    return intercept[segments] + slope[segments] * samples
+
+
+def read_synchronized_streams(fname, stream_types, dejitter=True):
+    """Read all streams of the given types with synchronized time stamps.
+
+    The time stamps are converted to the clock of the recording computer
+    with the fitted clock drift (see fit_clock_drift) and, for regular
+    streams, dejittered.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+    stream_types : list of str
+        Types of the streams to read (e.g. ['EEG', 'Markers']).
+    dejitter : bool
+        If True, the time stamps of regular streams are dejittered.
+
+    Returns
+    -------
+    streams : list of dicts
+        Streams as returned by read_stream, in file order.
+    """
+    index, infos = load_index(fname)
+    drift = fit_clock_drift(index)
+    streams = []
+    with open_xdf(fname) as f:
+        for info in infos:
+            if info["type"] not in stream_types:
+                continue
+            stream = read_stream(f, index, info)
+            intercept, slope = drift.get(info["stream_id"], (0.0, 0.0))
+            time_stamps = stream["time_stamps"]
+            time_stamps = time_stamps + (intercept + slope * time_stamps)
+            if dejitter:
+                time_stamps = dejitter_time_stamps(time_stamps,
+                                                   info["nominal_srate"])
+            stream["time_stamps"] = time_stamps
+            streams.append(stream)
+    return streams
+
+
+def align_streams(streams, markers, sfreq):
+    """Resample numeric streams and place markers on a common timeline.
+
+    The timeline runs at sfreq over the time range covered by all streams.
+    Each stream is linearly interpolated with a single sorted search of the
+    timeline in its time stamps and one gather of all channels. The samples
+    of irregular streams (e.g. a force sensor with a nominal sampling rate
+    of 0) are sorted by time stamp first, only the first of samples with
+    the same time stamp is kept.
+
+    Parameters
+    ----------
+    streams : dict
+        Numeric streams (as returned by read_synchronized_streams) keyed by
+        name.
+    markers : list of dicts
+        Markers streams (as returned by read_synchronized_streams).
+    sfreq : float
+        Sampling rate of the common timeline.
+
+    Returns
+    -------
+    aligned : dict
+        Time stamps of the timeline ("times"), the resampled data (shape
+        (n_channels, n_times)) and channel names of each stream keyed by
+        its name, and the markers inside the timeline ("markers": time
+        stamps, sample numbers and descriptions, sorted by time).
+    """
+    samples = {
+        name: _sort_samples(name, stream)
+        for name, stream in streams.items()
+    }
+    start = max(time_stamps[0] for time_stamps, _ in samples.values())
+    stop = min(time_stamps[-1] for time_stamps, _ in samples.values())
+    times = start + np.arange(int((stop - start) * sfreq) + 1) / sfreq
+
+    aligned = dict(times=times)
+    for name, stream in streams.items():
+        time_stamps, time_series = samples[name]
+        after = np.searchsorted(time_stamps, times, side="right")
+        after = np.clip(after, 1, len(time_stamps) - 1)
+        before = after - 1
+        weight = ((times - time_stamps[before]) /
+                  (time_stamps[after] - time_stamps[before]))[:, None]
+        data = (time_series[before] * (1 - weight) +
+                time_series[after] * weight)
+        ch_names, types, units = _get_ch_info(stream)
+        aligned[name] = dict(data=data.T, ch_names=ch_names)
+
+    marker_times = np.concatenate(
+        [stream["time_stamps"] for stream in markers] + [[]])
+    descriptions = np.concatenate(
+        [stream["time_series"][:, 0] for stream in markers] + [[]])
+    order = np.argsort(marker_times, kind="stable")
+    marker_times, descriptions = marker_times[order], descriptions[order]
+    inside = (marker_times >= start) & (marker_times <= stop)
+    marker_times = marker_times[inside]
+    # the timeline can end up to a sample period before stop
+    samples = np.minimum(np.rint((marker_times - start) * sfreq),
+                         len(times) - 1)
+    aligned["markers"] = dict(times=marker_times,
+                              samples=samples.astype(int),
+                              descriptions=descriptions[inside])
+    return aligned
+
+
+def _sort_samples(name, stream):
+    """Time stamps and samples of a stream, strictly increasing in time."""
+    time_stamps, time_series = stream["time_stamps"], stream["time_series"]
+    if time_series.dtype == object:
+        raise ValueError(f'The stream {name} has string samples, it cannot '
+                         'be interpolated.')
+    if not np.all(np.diff(time_stamps) > 0):
+        # repeated time stamps would divide by zero in the interpolation
+        time_stamps, first = np.unique(time_stamps, return_index=True)
+        time_series = time_series[first]
+    if len(time_stamps) < 2:
+        raise ValueError(f'The stream {name} has less than two distinct time '
+                         'stamps.')
+    return time_stamps, time_series
+
+
+def create_synchronized_data(config, subject):
+    """Align the EEG, markers and force data of a subject.
+
+    The EEG stream and all Markers streams are read from the EEG recording,
+    the stream of type config['force_stream_type'] from the force recording
+    (if there is one), and all of them are aligned at config['sfreq'].
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+
+    Returns
+    -------
+    aligned : dict
+        Aligned data as returned by align_streams, with the streams "eeg"
+        and "force".
+    """
+    # imported here, data.create_data imports h5py and the feature modules
+    from .create_data import get_xdf_path
+
+    read_path = get_xdf_path(config, subject)
+    force_path = Path(config['force_data_path']) / ('S_' + subject) / \
+        'force.xdf'
+
+    streams = read_synchronized_streams(read_path, ['EEG', 'Markers'])
+    regular = dict(eeg=next(s for s in streams if s["info"]["type"] == 'EEG'))
+    markers = [s for s in streams if s["info"]["type"] == 'Markers']
+    if force_path.exists():
+        force = read_synchronized_streams(force_path,
+                                          [config['force_stream_type']])
+        if force:
+            regular['force'] = force[0]
+    return align_streams(regular, markers, config['sfreq'])
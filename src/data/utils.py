@@ -0,0 +1,278 @@
+import hashlib
+import json
+from contextlib import nullcontext
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+# config keys the cached raw data depends on
+RAW_CACHE_KEYS = ['drop_channels', 'motion_channels', 'montage']
+
+# serializes access to the HDF5 interim store when subjects are processed
+# in parallel, see set_store_lock
+_store_lock = nullcontext()
+
+
+def set_store_lock(lock):
+    """Set the lock guarding the HDF5 interim store in this process."""
+    global _store_lock
+    _store_lock = lock
+
+
+def file_hash(fname, block_size=2**20):
+    """Compute the SHA-1 hash of a file's content.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the file.
+    block_size : int
+        Number of bytes read at a time.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal digest of the file content.
+    """
+    digest = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def raw_cache_key(config, fname):
+    """Key of a cached recording, built from the file and config content."""
+    keys = {key: config[key] for key in RAW_CACHE_KEYS}
+    return file_hash(fname) + '-' + json.dumps(keys, sort_keys=True)
+
+
+def save_raw(config, subject, raw, key):
+    """Save a raw recording to the HDF5 interim store.
+
+    The data is stored as a chunked, compressed dataset (one chunk per
+    ten seconds) under the group 'S_<subject>', so that time slices can be
+    read without decompressing the whole recording.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+    raw : mne.io.Raw
+        Raw recording.
+    key : str
+        Cache key of the recording (see raw_cache_key).
+    """
+    save_path = Path(config['raw_eeg_data'])
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    data = raw.get_data()
+    chunk_length = min(data.shape[1], int(10 * raw.info['sfreq']))
+    with _store_lock, h5py.File(save_path, 'a') as f:
+        if 'S_' + subject in f:
+            del f['S_' + subject]
+        group = f.create_group('S_' + subject)
+        group.attrs['key'] = key
+        group.attrs['sfreq'] = raw.info['sfreq']
+        group.attrs['ch_names'] = raw.ch_names
+        group.attrs['ch_types'] = raw.get_channel_types()
+        group.create_dataset('data',
+                             data=data,
+                             chunks=(data.shape[0], max(chunk_length, 1)),
+                             compression='gzip',
+                             compression_opts=1,
+                             shuffle=True)
+        annotations = group.create_group('annotations')
+        annotations['onset'] = raw.annotations.onset
+        annotations['duration'] = raw.annotations.duration
+        annotations['description'] = raw.annotations.description.astype(
+            h5py.string_dtype())
+
+
+def load_raw(config, subject, key=None, tmin=None, tmax=None):
+    """Load a raw recording from the HDF5 interim store.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+    key : str | None
+        Expected cache key. If given and the stored key differs, the cached
+        recording is considered stale.
+    tmin : float | None
+        Start time (in seconds) of the data to read.
+    tmax : float | None
+        End time (in seconds) of the data to read.
+
+    Returns
+    -------
+    raw : mne.io.Raw | None
+        Raw recording, or None if it is not cached (or stale).
+    """
+    import mne
+
+    save_path = Path(config['raw_eeg_data'])
+    with _store_lock:
+        if not save_path.exists():
+            return None
+        with h5py.File(save_path, 'r') as f:
+            group = f.get('S_' + subject)
+            if group is None or (key is not None
+                                 and group.attrs['key'] != key):
+                return None
+            sfreq = group.attrs['sfreq']
+            n_times = group['data'].shape[1]
+            start = 0 if tmin is None else max(int(round(tmin * sfreq)), 0)
+            stop = n_times if tmax is None else min(
+                int(round(tmax * sfreq)) + 1, n_times)
+            data = group['data'][:, start:stop]
+            info = mne.create_info(ch_names=list(group.attrs['ch_names']),
+                                   sfreq=sfreq,
+                                   ch_types=list(group.attrs['ch_types']))
+            onset = group['annotations/onset'][()] - start / sfreq
+            duration = group['annotations/duration'][()]
+            description = group['annotations/description'].asstr()[()]
+
+    raw = mne.io.RawArray(data, info, verbose=False)
+    keep = (onset >= 0) & (onset < (stop - start) / sfreq)
+    raw.set_annotations(
+        mne.Annotations(onset[keep], duration[keep],
+                        np.asarray(description)[keep]))
+    raw.set_montage(montage=config['montage'], verbose=False)
+    return raw
+
+
+def save_features(config, subject, features):
+    """Save the features of a subject next to its raw data.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+    features : dict
+        Features as returned by compute_eeg_features.
+    """
+    save_path = Path(config['raw_eeg_data'])
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    with _store_lock, h5py.File(save_path, 'a') as f:
+        group = f.require_group('S_' + subject)
+        if 'features' in group:
+            del group['features']
+        group = group.create_group('features')
+        group.attrs['ch_names'] = features['ch_names']
+        for name, value in features.items():
+            if name != 'ch_names':
+                group.create_dataset(name, data=value)
+
+
+def save_psd_block(config, subject, start, psds, nfreqs, n_epochs):
+    """Write the PSD of a block of epochs to the HDF5 interim store.
+
+    The PSD of all epochs is stored under 'S_<subject>/psd', the dataset is
+    (re)created when the first block (start == 0) is written.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+    start : int
+        Index of the first epoch of the block.
+    psds : array, shape (n_block_epochs, n_channels, n_freqs)
+        PSD of the epochs of the block.
+    nfreqs : array, shape (n_freqs, )
+        Frequencies of the PSD.
+    n_epochs : int
+        Total number of epochs.
+    """
+    save_path = Path(config['raw_eeg_data'])
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    with _store_lock, h5py.File(save_path, 'a') as f:
+        group = f.require_group('S_' + subject)
+        if start == 0:
+            if 'psd' in group:
+                del group['psd']
+            psd = group.create_group('psd')
+            psd['nfreqs'] = nfreqs
+            # chunks of about 1 MB
+            epoch_bytes = psds[0].nbytes
+            psd.create_dataset('psds',
+                               shape=(n_epochs, ) + psds.shape[1:],
+                               dtype=psds.dtype,
+                               chunks=(min(max(2**20 // epoch_bytes, 1),
+                                           n_epochs), ) + psds.shape[1:])
+        group['psd/psds'][start:start + len(psds)] = psds
+
+
+def load_psd_blocks(config, subject):
+    """Read the PSD stored with save_psd_block block by block.
+
+    The blocks hold as many epochs as fit config['psd_memory_budget'].
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+
+    Yields
+    ------
+    psds : array, shape (n_block_epochs, n_channels, n_freqs)
+        PSD of the epochs of the block.
+    """
+    save_path = Path(config['raw_eeg_data'])
+    with _store_lock, h5py.File(save_path, 'r') as f:
+        shape = f['S_' + subject + '/psd/psds'].shape
+    epoch_bytes = 8 * shape[1] * shape[2]
+    block_size = max(config['psd_memory_budget'] * 2**20 // epoch_bytes, 1)
+    for start in range(0, shape[0], block_size):
+        with _store_lock, h5py.File(save_path, 'r') as f:
+            psds = f['S_' + subject + '/psd/psds'][start:start + block_size]
+        yield psds
+
+
+def get_psd_shape(config, subject):
+    """Shape of the PSD stored with save_psd_block, None if not stored."""
+    save_path = Path(config['raw_eeg_data'])
+    with _store_lock:
+        if not save_path.exists():
+            return None
+        with h5py.File(save_path, 'r') as f:
+            psds = f.get('S_' + subject + '/psd/psds')
+            return None if psds is None else psds.shape
+
+
+def load_features(config, subject):
+    """Load the features of a subject saved with save_features.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+
+    Returns
+    -------
+    features : dict | None
+        Features of the subject, or None if they are not stored.
+    """
+    save_path = Path(config['raw_eeg_data'])
+    with _store_lock:
+        if not save_path.exists():
+            return None
+        with h5py.File(save_path, 'r') as f:
+            group = f.get('S_' + subject + '/features')
+            if group is None:
+                return None
+            features = {name: value[()] for name, value in group.items()}
+            features['ch_names'] = list(group.attrs['ch_names'])
+    return features
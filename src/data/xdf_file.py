@@ -0,0 +1,145 @@
+from .mne_import_xdf import (_get_ch_info, _index_streaminfos, _match_request,
+                             load_index, open_xdf, read_stream)
+
+
+class XdfFile(object):
+    """Lazy view of an XDF recording.
+
+    Only the chunk index (see load_index) is read when the streams are
+    inspected, so opening even a large recording costs header-sized I/O
+    once the index is stored. The samples of a stream are decoded when its
+    data is first accessed.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+
+    Attributes
+    ----------
+    streams : list of dicts
+        Information on each stream (as returned by resolve_streams).
+
+    Examples
+    --------
+    >>> with XdfFile('eeg.xdf') as xdf:
+    ...     eeg, = xdf.select(type='EEG', name='eegoSports')
+    ...     data, times = eeg.slice(10.0, 20.0)
+
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.index, self.streams = load_index(fname)
+        self.lookup = _index_streaminfos(self.streams)
+        self.f = None
+
+    def select(self, **criteria):
+        """Select the streams whose information matches all criteria.
+
+        Parameters
+        ----------
+        **criteria
+            Values of the stream information fields (e.g. type='EEG'),
+            without criteria all streams are selected.
+
+        Returns
+        -------
+        streams : list of XdfStream
+            Matching streams, in file order.
+        """
+        stream_ids = _match_request(
+            self.lookup, [info["stream_id"] for info in self.streams],
+            criteria)
+        return [
+            XdfStream(self, info) for info in self.streams
+            if info["stream_id"] in stream_ids
+        ]
+
+    def read_stream(self, info, tmin=None, tmax=None):
+        """Decode the samples of a stream (see mne_import_xdf.read_stream).
+
+        The file is opened on the first call and kept open until close.
+        """
+        if self.f is None:
+            self.f = open_xdf(self.fname)
+        return read_stream(self.f, self.index, info, tmin, tmax)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class XdfStream(object):
+    """Stream of an XDF file decoded on demand.
+
+    Parameters
+    ----------
+    xdf : XdfFile
+        File containing the stream.
+    info : dict
+        Information on the stream (as returned by resolve_streams).
+
+    Attributes
+    ----------
+    ch_names : list of str
+        Channel labels of the stream.
+
+    """
+    def __init__(self, xdf, info):
+        self.xdf = xdf
+        self.info = info
+        self.ch_names = _get_ch_info(dict(info=info))[0]
+        self._stream = None
+
+    def __repr__(self):
+        return (f"<XdfStream {self.info['stream_id']} '{self.info['name']}' "
+                f"({self.info['type']}, {self.info['channel_count']} "
+                f"channels)>")
+
+    def _read(self):
+        if self._stream is None:
+            self._stream = self.xdf.read_stream(self.info)
+        return self._stream
+
+    @property
+    def data(self):
+        """Samples of the stream, shape (n_samples, n_channels)."""
+        return self._read()["time_series"]
+
+    @property
+    def times(self):
+        """Time stamps of the samples, shape (n_samples, )."""
+        return self._read()["time_stamps"]
+
+    def slice(self, tmin, tmax):
+        """Decode the samples between two time stamps.
+
+        Only the chunks overlapping [tmin, tmax] are read, unless the whole
+        stream was already decoded.
+
+        Parameters
+        ----------
+        tmin : float
+            First time stamp.
+        tmax : float
+            Last time stamp.
+
+        Returns
+        -------
+        data : array, shape (n_samples, n_channels)
+            Samples of the time range.
+        times : array, shape (n_samples, )
+            Time stamps of the samples.
+        """
+        if self._stream is not None:
+            keep = (self.times >= tmin) & (self.times <= tmax)
+            return self.data[keep], self.times[keep]
+        stream = self.xdf.read_stream(self.info, tmin, tmax)
+        return stream["time_series"], stream["time_stamps"]
@@ -0,0 +1,166 @@
+import numpy as np
+
+from features.psd import get_epoch_blocks, get_epoch_windows
+
+
+def get_epoch_statistics(data, motion, sfreq, config):
+    """Peak-to-peak amplitude, variance and motion of every epoch.
+
+    The statistics are computed on the strided epochs of the continuous
+    data (see get_epoch_windows), config['psd_batch_size'] epochs at a time
+    so that the temporary copies stay small.
+
+    Parameters
+    ----------
+    data : array, shape (n_channels, n_times)
+        Continuous EEG data.
+    motion : array, shape (n_axes, n_times) | None
+        Continuous accelerometer data.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    statistics : dict
+        Peak-to-peak amplitude and variance of each epoch and channel
+        (shape (n_epochs, n_channels)) and, if motion is given, the standard
+        deviation of the magnitude of the acceleration in each epoch (shape
+        (n_epochs, )).
+    """
+    windows, step = get_epoch_windows(data, sfreq, config)
+    ptp = np.empty(windows.shape[:2])
+    var = np.empty(windows.shape[:2])
+    batch_size = config['psd_batch_size']
+    for start in range(0, len(windows), batch_size):
+        batch = windows[start:start + batch_size]
+        ptp[start:start + batch_size] = np.ptp(batch, axis=-1)
+        var[start:start + batch_size] = batch.var(axis=-1)
+    statistics = dict(ptp=ptp, var=var)
+    if motion is not None:
+        windows, step = get_epoch_windows(motion, sfreq, config)
+        statistics['motion'] = np.empty(len(windows))
+        for start in range(0, len(windows), batch_size):
+            batch = windows[start:start + batch_size]
+            magnitude = np.sqrt((batch**2).sum(axis=1))
+            statistics['motion'][start:start + batch_size] = magnitude.std(
+                axis=-1)
+    return statistics
+
+
+def get_block_statistics(read, read_motion, n_times, n_channels, sfreq,
+                         config):
+    """Statistics of get_epoch_statistics, reading the data block by block.
+
+    The blocks of epochs are the ones of features.psd.iter_psd_blocks, so
+    that only config['psd_memory_budget'] MB of data are read at a time.
+    The statistics are the same as on the whole data.
+
+    Parameters
+    ----------
+    read : function
+        Called as read(start, stop), returns the samples start to stop of
+        the continuous EEG data as an array of shape (n_channels,
+        stop - start).
+    read_motion : function | None
+        Same as read for the accelerometer data, no motion statistics if
+        None.
+    n_times : int
+        Number of samples of the continuous data.
+    n_channels : int
+        Number of EEG channels.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    statistics : dict
+        See get_epoch_statistics.
+    """
+    blocks = []
+    for start, stop, first, last in get_epoch_blocks(n_times, n_channels,
+                                                     sfreq, config):
+        motion = None if read_motion is None else read_motion(first, last)
+        blocks.append(
+            get_epoch_statistics(read(first, last), motion, sfreq, config))
+    return {
+        name: np.concatenate([block[name] for block in blocks])
+        for name in blocks[0]
+    }
+
+
+def _robust_zscore(values, axis=0):
+    """Z-score from the median and the median absolute deviation."""
+    median = np.median(values, axis=axis, keepdims=True)
+    mad = 1.4826 * np.median(np.abs(values - median), axis=axis, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nan_to_num((values - median) / mad)
+
+
+def find_artifacts(data, motion, sfreq, config):
+    """Find the bad channels and epochs of a recording before its PSD.
+
+    See find_artifacts_from_statistics.
+
+    Parameters
+    ----------
+    data : array, shape (n_channels, n_times)
+        Continuous EEG data (in volts).
+    motion : array, shape (n_axes, n_times) | None
+        Continuous accelerometer data, no motion criterion if None.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    bad_epochs : array of bool, shape (n_epochs, )
+        Rejected epochs.
+    bad_channels : array of bool, shape (n_channels, )
+        Rejected channels.
+    """
+    return find_artifacts_from_statistics(
+        get_epoch_statistics(data, motion, sfreq, config), config)
+
+
+def find_artifacts_from_statistics(statistics, config):
+    """Find the bad channels and epochs from the statistics of the epochs.
+
+    A channel is bad if it is flat (median peak-to-peak amplitude below
+    config['flat_ptp']), if the robust z-score of its median log-variance
+    across channels exceeds config['bad_channel_z'], or if more than
+    config['bad_channel_fraction'] of its epochs exceed config['reject_ptp'].
+    An epoch is bad if a good channel exceeds config['reject_ptp'] or if the
+    robust z-score of its motion exceeds config['reject_motion_z'].
+
+    Parameters
+    ----------
+    statistics : dict
+        Statistics of the epochs, see get_epoch_statistics and
+        get_block_statistics.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    bad_epochs : array of bool, shape (n_epochs, )
+        Rejected epochs.
+    bad_channels : array of bool, shape (n_channels, )
+        Rejected channels.
+    """
+    ptp = statistics['ptp']
+    high = ptp > config['reject_ptp']
+    log_var = np.log(
+        np.median(statistics['var'], axis=0) + np.finfo(float).tiny)
+    bad_channels = ((np.median(ptp, axis=0) < config['flat_ptp'])
+                    | (_robust_zscore(log_var) > config['bad_channel_z'])
+                    | (high.mean(axis=0) > config['bad_channel_fraction']))
+    bad_epochs = high[:, ~bad_channels].any(axis=1)
+    if 'motion' in statistics:
+        bad_epochs |= (_robust_zscore(statistics['motion']) >
+                       config['reject_motion_z'])
+    return bad_epochs, bad_channels
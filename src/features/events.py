@@ -0,0 +1,162 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from data.create_data import EEG_CH_NAMES, get_xdf_path
+from data.mne_import_xdf import _get_ch_info
+from data.sync import read_synchronized_streams
+
+
+def index_markers(marker_times, descriptions, eeg_times):
+    """Convert marker time stamps to EEG samples, grouped by description.
+
+    Each marker is mapped to the EEG sample nearest to it with a single
+    np.searchsorted of all markers in the EEG time stamps, and the markers
+    are grouped by description with one stable sort, so the cost does not
+    depend on the number of markers through Python loops. Markers outside
+    of the EEG recording are dropped.
+
+    Parameters
+    ----------
+    marker_times : array, shape (n_markers, )
+        Time stamps of the markers.
+    descriptions : array of str, shape (n_markers, )
+        Description of each marker.
+    eeg_times : array, shape (n_times, )
+        Sorted time stamps of the EEG samples, on the same clock as the
+        markers (see data.sync.read_synchronized_streams).
+
+    Returns
+    -------
+    markers : dict
+        Events array (shape (n_events, 3): sample, 0 and event code, sorted
+        by time as for mne.Epochs), the description of each event code and
+        the samples of the events of each description.
+    """
+    marker_times = np.asarray(marker_times, dtype=float)
+    descriptions = np.asarray(descriptions)
+    order = np.argsort(marker_times, kind='stable')
+    marker_times, descriptions = marker_times[order], descriptions[order]
+    inside = (marker_times >= eeg_times[0]) & (marker_times <= eeg_times[-1])
+    marker_times, descriptions = marker_times[inside], descriptions[inside]
+
+    after = np.clip(np.searchsorted(eeg_times, marker_times), 1,
+                    max(len(eeg_times) - 1, 1))
+    before = after - 1
+    samples = np.where(
+        marker_times - eeg_times[before] <= eeg_times[after] - marker_times,
+        before, after)
+
+    names, codes = np.unique(descriptions, return_inverse=True)
+    codes = codes.ravel()
+    by_code = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes, minlength=len(names)))[:-1]
+    events = np.stack((samples, np.zeros_like(samples), codes + 1), axis=1)
+    return dict(events=events,
+                event_id={str(name): code + 1
+                          for code, name in enumerate(names)},
+                samples=dict(
+                    zip(map(str, names), np.split(samples[by_code],
+                                                  bounds))))
+
+
+def get_event_windows(data, samples, sfreq, tmin, tmax):
+    """Windows of continuous data around events, as a strided view.
+
+    Parameters
+    ----------
+    data : array, shape (n_channels, n_times)
+        Continuous data.
+    samples : array of int, shape (n_events, )
+        Samples of the events.
+    sfreq : float
+        Sampling frequency of the data.
+    tmin, tmax : float
+        Start and end (in seconds, relative to the events) of the windows.
+
+    Returns
+    -------
+    windows : array, shape (n_channels, n_starts, n_samples)
+        Read-only strided view of every window of data, without copying it.
+    starts : array of int, shape (n_kept, )
+        Index in windows of the window of each event that lies entirely
+        inside the data, windows[:, starts] gathers them.
+    keep : array of bool, shape (n_events, )
+        Events whose window lies entirely inside the data.
+    """
+    offset = int(round(tmin * sfreq))
+    n_samples = int(round(tmax * sfreq)) - offset + 1
+    windows = sliding_window_view(data, n_samples, axis=-1)
+    starts = np.asarray(samples) + offset
+    keep = (starts >= 0) & (starts < windows.shape[1])
+    return windows, starts[keep], keep
+
+
+def get_event_epochs(data, samples, sfreq, tmin, tmax):
+    """Epochs of continuous data around events.
+
+    The epochs are gathered from the strided view of get_event_windows with
+    a single fancy index, only the samples of the epochs are copied.
+
+    Returns
+    -------
+    epochs : array, shape (n_kept, n_channels, n_samples)
+        Epoch of each event whose window lies entirely inside the data.
+    keep : array of bool, shape (n_events, )
+        Events with an epoch.
+    """
+    windows, starts, keep = get_event_windows(data, samples, sfreq, tmin, tmax)
+    return windows[:, starts].transpose(1, 0, 2), keep
+
+
+def create_event_epochs(config, subject, descriptions=None):
+    """Epoch the EEG of a subject around its game events.
+
+    The EEG and all Markers streams are read with synchronized time stamps
+    (see data.sync.read_synchronized_streams), the markers are indexed with
+    index_markers and the epochs span config['event_tmin'] to
+    config['event_tmax'] seconds around each event.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+    descriptions : list of str | None
+        Marker descriptions to epoch, all if None.
+
+    Returns
+    -------
+    event_epochs : dict
+        The channel names, the times of the samples of an epoch relative to
+        its event and, in "events", the epochs (shape (n_events,
+        n_channels, n_samples), in volts) and the time stamps of the events
+        of each description.
+    """
+    streams = read_synchronized_streams(get_xdf_path(config, subject),
+                                        ['EEG', 'Markers'])
+    eeg = next(s for s in streams if s["info"]["type"] == 'EEG')
+    markers = [s for s in streams if s["info"]["type"] == 'Markers']
+    ch_names, types, units = _get_ch_info(eeg)
+    picks = [ch_names.index(ch) for ch in EEG_CH_NAMES]
+    scale = np.array([1e-6 if u == "microvolts" else 1 for u in units])
+    data = eeg["time_series"][:, picks].T * scale[picks, None]
+    sfreq = float(eeg["info"]["nominal_srate"])
+
+    index = index_markers(
+        np.concatenate([s["time_stamps"] for s in markers] + [[]]),
+        np.concatenate([s["time_series"][:, 0] for s in markers] + [[]]),
+        eeg["time_stamps"])
+    tmin, tmax = config['event_tmin'], config['event_tmax']
+    event_epochs = dict(ch_names=list(EEG_CH_NAMES),
+                        times=np.arange(
+                            int(round(tmin * sfreq)),
+                            int(round(tmax * sfreq)) + 1) / sfreq,
+                        events={})
+    for description, samples in index['samples'].items():
+        if descriptions is not None and description not in descriptions:
+            continue
+        epochs, keep = get_event_epochs(data, samples, sfreq, tmin, tmax)
+        event_epochs['events'][description] = dict(
+            epochs=epochs, event_times=eeg["time_stamps"][samples[keep]])
+    return event_epochs
@@ -0,0 +1,231 @@
+import time
+
+import numpy as np
+
+from data.create_data import get_engagement_workload
+from data.mne_import_xdf import (_find_stream_by_type, _get_ch_info,
+                                 load_index, open_xdf, read_stream)
+from features.psd import compute_psd, get_epoch_step
+
+
+class RingBuffer(object):
+    """Fixed-size buffer holding the latest samples of each channel.
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels.
+    n_samples : int
+        Number of samples kept per channel.
+
+    Attributes
+    ----------
+    n_written : int
+        Total number of samples written to the buffer.
+
+    """
+    def __init__(self, n_channels, n_samples):
+        self.data = np.zeros((n_channels, n_samples))
+        self.n_written = 0
+
+    def extend(self, samples):
+        """Append samples of shape (n_channels, n), dropping the oldest."""
+        size = self.data.shape[1]
+        n_samples = samples.shape[1]
+        samples = samples[:, -size:]
+        # the dropped samples still count as written
+        start = (self.n_written + n_samples - samples.shape[1]) % size
+        first = min(samples.shape[1], size - start)
+        self.data[:, start:start + first] = samples[:, :first]
+        self.data[:, :samples.shape[1] - first] = samples[:, first:]
+        self.n_written += n_samples
+
+    def latest(self):
+        """The buffered samples in chronological order."""
+        start = self.n_written % self.data.shape[1]
+        return np.concatenate((self.data[:, start:], self.data[:, :start]),
+                              axis=1)
+
+
+class XdfReplaySource(object):
+    """Replay the EEG stream of an XDF file like a live LSL inlet.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the XDF file.
+    chunk_duration : float
+        Duration (in seconds) of the chunks returned by pull_chunk.
+    realtime : bool
+        If True, pull_chunk waits until the samples of a chunk would have
+        been recorded, otherwise the chunks are returned immediately.
+
+    Attributes
+    ----------
+    ch_names : list of str
+        Channel labels of the stream.
+    sfreq : float
+        Nominal sampling rate of the stream.
+
+    """
+    def __init__(self, fname, chunk_duration=0.04, realtime=True):
+        index, streams = load_index(fname)
+        stream = _find_stream_by_type(streams, stream_type="EEG")
+        with open_xdf(fname) as f:
+            self.stream = read_stream(f, index, stream)
+        self.ch_names, types, units = _get_ch_info(self.stream)
+        self.sfreq = stream["nominal_srate"]
+        self.chunk_size = max(int(round(chunk_duration * self.sfreq)), 1)
+        self.realtime = realtime
+        self.position = 0
+        self.start_time = None
+
+    def pull_chunk(self):
+        """Return the next chunk of samples and their time stamps.
+
+        Returns
+        -------
+        samples : array, shape (n_samples, n_channels) | None
+            Samples of the chunk, None once the recording is exhausted.
+        time_stamps : array, shape (n_samples, ) | None
+            Time stamps of the samples.
+        """
+        time_series = self.stream["time_series"]
+        if self.position >= len(time_series):
+            return None, None
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        stop = self.position + self.chunk_size
+        if self.realtime:
+            due = self.start_time + min(stop, len(time_series)) / self.sfreq
+            time.sleep(max(due - time.perf_counter(), 0))
+        chunk = slice(self.position, stop)
+        self.position = stop
+        return time_series[chunk], self.stream["time_stamps"][chunk]
+
+
+class LSLSource(object):
+    """Live EEG stream received with pylsl.
+
+    Parameters
+    ----------
+    stream_type : str
+        Type of the LSL stream to resolve.
+    timeout : float
+        Time (in seconds) to wait for the stream to be found.
+
+    Attributes
+    ----------
+    ch_names : list of str
+        Channel labels of the stream.
+    sfreq : float
+        Nominal sampling rate of the stream.
+
+    """
+    def __init__(self, stream_type='EEG', timeout=10.0):
+        import pylsl
+
+        streams = pylsl.resolve_byprop('type', stream_type, timeout=timeout)
+        if not streams:
+            raise RuntimeError(f'No LSL stream of type {stream_type} found.')
+        self.inlet = pylsl.StreamInlet(streams[0])
+        info = self.inlet.info()
+        self.sfreq = info.nominal_srate()
+        self.ch_names = []
+        channel = info.desc().child('channels').child('channel')
+        for _ in range(info.channel_count()):
+            self.ch_names.append(channel.child_value('label'))
+            channel = channel.next_sibling()
+
+    def pull_chunk(self):
+        """Return the samples received since the last call."""
+        samples, time_stamps = self.inlet.pull_chunk(timeout=1.0)
+        return np.array(samples).reshape(-1, len(self.ch_names)), \
+            np.array(time_stamps)
+
+
+def monitor_engagement_workload(source, config):
+    """Compute the engagement and workload of a live EEG stream.
+
+    The latest samples of the EEG channels are kept in a ring buffer, and
+    an update is emitted every epoch step (see get_epoch_step). The updates
+    are computed on the epochs of the offline features (see
+    data.create_data.compute_eeg_features), whatever the size of the
+    chunks: the epoch ends at the last step boundary reached, not at the
+    last sample received. If computing an update takes longer than a step,
+    the stale steps are skipped so that the latency stays bounded.
+
+    Parameters
+    ----------
+    source : XdfReplaySource | LSLSource
+        Source of the EEG samples.
+    config : dict
+        Configuration dictionary.
+
+    Yields
+    ------
+    update : dict
+        Time stamp of the last sample of the epoch, engagement and workload
+        of each channel, latency (in seconds, from receiving the chunk to
+        the update) and number of skipped steps.
+    """
+    picks = [
+        i for i, ch_name in enumerate(source.ch_names)
+        if ch_name not in config['drop_channels'] +
+        config['motion_channels']
+    ]
+    n_samples, step = get_epoch_step(source.sfreq, config)
+    # the epoch ends less than a step before the last sample received
+    buffer = RingBuffer(len(picks), n_samples + step)
+    next_update = n_samples
+    while True:
+        samples, time_stamps = source.pull_chunk()
+        if samples is None:
+            return
+        if not len(samples):
+            continue
+        received = time.perf_counter()
+        buffer.extend(samples[:, picks].T)
+        if buffer.n_written < next_update:
+            continue
+        skipped = (buffer.n_written - next_update) // step
+        end = next_update + skipped * step
+        next_update = end + step
+
+        # the samples received after the end of the epoch, all in this chunk
+        lag = buffer.n_written - end
+        data = buffer.latest()[:, -lag - n_samples:buffer.data.shape[1] - lag]
+        psds, nfreqs = compute_psd(data, source.sfreq, config, n_jobs=1)
+        engagement, workload = get_engagement_workload(
+            psds[-1], nfreqs, config['freq_bands'])
+        yield dict(time=time_stamps[len(time_stamps) - lag - 1],
+                   engagement=engagement,
+                   workload=workload,
+                   latency=time.perf_counter() - received,
+                   skipped=skipped)
+
+
+def run_online_monitor(source, config):
+    """Run the online monitor until the source ends and report latency.
+
+    Parameters
+    ----------
+    source : XdfReplaySource | LSLSource
+        Source of the EEG samples.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    updates : list of dicts
+        All updates emitted by monitor_engagement_workload.
+    """
+    updates = list(monitor_engagement_workload(source, config))
+    latency = np.array([update['latency'] for update in updates]) * 1e3
+    skipped = sum(update['skipped'] for update in updates)
+    if len(latency):
+        print(f'{len(updates)} updates, latency median '
+              f'{np.median(latency):.1f} ms, 95th percentile '
+              f'{np.percentile(latency, 95):.1f} ms, max '
+              f'{latency.max():.1f} ms, {skipped} skipped steps')
+    return updates
@@ -0,0 +1,433 @@
+import functools
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import rfft, rfftfreq
+from scipy.signal import get_window
+from scipy.signal.windows import dpss
+
+FMIN, FMAX = 1.0, 64.0
+
+# rough number of float64 copies of an epoch sample alive while computing
+# its PSD (epoch copy, tapered epochs, complex spectra), see get_block_size
+_WORK_FACTOR = 16
+
+
+def get_epoch_step(sfreq, config):
+    """Number of samples of an epoch and between the start of two epochs."""
+    n_samples = int(round(config['epoch_length'] * sfreq))
+    step = max(int(round(n_samples * (1 - config['overlap']))), 1)
+    return n_samples, step
+
+
+def get_n_epochs(n_times, sfreq, config):
+    """Number of overlapping epochs of n_times samples of continuous data."""
+    n_samples, step = get_epoch_step(sfreq, config)
+    return max((n_times - n_samples) // step + 1, 0)
+
+
+def get_epoch_windows(data, sfreq, config):
+    """Overlapping epochs of continuous data, without copying it.
+
+    Parameters
+    ----------
+    data : array, shape (n_channels, n_times)
+        Continuous data.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary, the epoch length (in seconds) and the
+        overlap (fraction of the epoch length) are read from it.
+
+    Returns
+    -------
+    windows : array, shape (n_epochs, n_channels, n_samples)
+        Read-only strided view of the epochs on data.
+    step : int
+        Number of samples between the start of two epochs.
+    """
+    n_samples, step = get_epoch_step(sfreq, config)
+    windows = sliding_window_view(data, n_samples, axis=-1)[:, ::step]
+    return windows.transpose(1, 0, 2), step
+
+
+def compute_psd(data,
+                sfreq,
+                config,
+                n_jobs=6,
+                bad_epochs=None,
+                bad_channels=None):
+    """Compute the PSD of the overlapping epochs of continuous data.
+
+    Parameters
+    ----------
+    data : array, shape (n_channels, n_times)
+        Continuous data.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary, config['psd_method'] selects the
+        'multitaper' or the 'welch' method.
+    n_jobs : int
+        Number of jobs of the multitaper method.
+    bad_epochs : array of bool, shape (n_epochs, ) | None
+        Epochs whose PSD is not computed (left as NaN), e.g. found with
+        features.artifacts.find_artifacts.
+    bad_channels : array of bool, shape (n_channels, ) | None
+        Channels whose PSD is not computed (left as NaN).
+
+    Returns
+    -------
+    psds : array, shape (n_epochs, n_channels, n_freqs)
+        Power spectral density of each epoch.
+    nfreqs : array, shape (n_freqs, )
+        Frequencies of the PSD.
+    """
+    if bad_epochs is None and bad_channels is None:
+        if config['psd_method'] == 'welch':
+            return compute_welch_psd(data, sfreq, config)
+        windows, step = get_epoch_windows(data, sfreq, config)
+        return compute_multitaper_psd(windows, sfreq, config, n_jobs=n_jobs)
+
+    n_epochs = get_n_epochs(data.shape[1], sfreq, config)
+    epochs = np.arange(n_epochs) if bad_epochs is None else \
+        np.flatnonzero(~bad_epochs)
+    channels = np.arange(len(data)) if bad_channels is None else \
+        np.flatnonzero(~bad_channels)
+    if not len(epochs) or not len(channels):
+        raise ValueError('All epochs or channels are bad.')
+    if config['psd_method'] == 'welch':
+        # the segment spectra are shared by the epochs, only the bad
+        # channels are skipped
+        psds, nfreqs = compute_welch_psd(data[channels], sfreq, config)
+        psds = psds[epochs]
+    else:
+        windows, step = get_epoch_windows(data, sfreq, config)
+        psds, nfreqs = compute_multitaper_psd(windows,
+                                              sfreq,
+                                              config,
+                                              n_jobs=n_jobs,
+                                              epochs=epochs,
+                                              channels=channels)
+    all_psds = np.full((n_epochs, len(data), len(nfreqs)), np.nan)
+    all_psds[np.ix_(epochs, channels)] = psds
+    return all_psds, nfreqs
+
+
+def compute_multitaper_psd(windows,
+                           sfreq,
+                           config,
+                           n_jobs=6,
+                           epochs=None,
+                           channels=None):
+    """Compute the multitaper PSD of epochs in batches.
+
+    Only config['psd_batch_size'] epochs at a time are copied out of the
+    (possibly strided) epochs, so overlapping epochs do not multiply the
+    memory needed. The tapers come from get_multitaper_kernel, so they are
+    computed once per epoch length, and each batch is tapered by
+    broadcasting and transformed with a single rfft. The result is the
+    one of mne.time_frequency.psd_array_multitaper (non-adaptive, full
+    normalization, bandwidth config['multitaper_bandwidth']).
+
+    Parameters
+    ----------
+    windows : array, shape (n_epochs, n_channels, n_samples)
+        Epochs, e.g. as returned by get_epoch_windows.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary.
+    n_jobs : int
+        Number of threads of the FFT.
+    epochs : array of int | None
+        Indices of the epochs to use. If None, all epochs are used.
+    channels : array of int | None
+        Indices of the channels to use. If None, all channels are used.
+
+    Returns
+    -------
+    psds : array, shape (n_epochs, n_channels, n_freqs)
+        Power spectral density of each (selected) epoch.
+    nfreqs : array, shape (n_freqs, )
+        Frequencies of the PSD.
+    """
+    kernel = get_multitaper_kernel(windows.shape[-1], sfreq,
+                                   config.get('multitaper_bandwidth'),
+                                   config.get('spectral_cache_path'))
+    if epochs is None:
+        epochs = np.arange(len(windows))
+    n_channels = windows.shape[1] if channels is None else len(channels)
+    psds = np.empty((len(epochs), n_channels, len(kernel['nfreqs'])))
+    batch_size = config['psd_batch_size']
+    for start in range(0, len(epochs), batch_size):
+        batch = windows[epochs[start:start + batch_size]]
+        if channels is not None:
+            batch = batch[:, channels]
+        batch -= batch.mean(axis=-1, keepdims=True)
+        spectra = rfft(batch[..., None, :] * kernel['tapers'],
+                       axis=-1,
+                       workers=n_jobs)[..., kernel['freq_mask']]
+        power = spectra.real**2 + spectra.imag**2
+        psds[start:start + batch_size] = np.einsum(
+            'k,...kf->...f', kernel['weights'], power) * kernel['freq_scale']
+    return psds, kernel['nfreqs']
+
+
+@functools.lru_cache(maxsize=16)
+def get_multitaper_kernel(n_samples, sfreq, bandwidth=None, cache_path=None):
+    """DPSS tapers and scaling of the multitaper PSD of an epoch length.
+
+    The tapers are the ones of mne.time_frequency.psd_array_multitaper
+    (with low_bias=True): the DPSS of half-bandwidth bandwidth * n_samples
+    / (2 * sfreq) (4 if bandwidth is None) whose concentration ratio
+    exceeds 0.9. Kernels are kept in memory with LRU eviction and, if
+    cache_path is given, saved there so that other processes and later
+    runs load them instead of solving for the tapers again. The FFT plans
+    are cached by scipy.fft for the same lengths.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples of an epoch.
+    sfreq : float
+        Sampling frequency of the data.
+    bandwidth : float | None
+        Frequency bandwidth (in Hz) of the tapers.
+    cache_path : str | None
+        Folder of the saved tapers.
+
+    Returns
+    -------
+    kernel : dict
+        The tapers (shape (n_tapers, n_samples)), the weight of each taper,
+        the mask of the kept rfft frequencies, the scale of each kept
+        frequency (1/2 at DC and Nyquist) and the kept frequencies.
+    """
+    half_nbw = 4.0 if bandwidth is None else \
+        float(bandwidth) * n_samples / (2 * sfreq)
+    if half_nbw < 0.5:
+        raise ValueError(f'The bandwidth {bandwidth} Hz is too small for '
+                         f'epochs of {n_samples} samples.')
+    fname = None
+    if cache_path is not None:
+        fname = Path(cache_path) / f'dpss_{n_samples}_{half_nbw:g}.npz'
+    tapers = None
+    if fname is not None and fname.exists():
+        try:
+            with np.load(fname, allow_pickle=False) as stored:
+                tapers, ratios = stored['tapers'], stored['ratios']
+        except (zipfile.BadZipFile, OSError, KeyError, ValueError):
+            tapers = None  # e.g. an interrupted write, solved again
+    if tapers is None:
+        tapers, ratios = dpss(n_samples,
+                              half_nbw,
+                              int(2 * half_nbw),
+                              sym=False,
+                              return_ratios=True)
+        if fname is not None:
+            _save_tapers(fname, tapers, ratios)
+    keep = ratios > 0.9
+    if not keep.any():
+        keep = ratios == ratios.max()
+    tapers, ratios = tapers[keep], ratios[keep]
+
+    nfreqs = rfftfreq(n_samples, 1 / sfreq)
+    freq_mask = (nfreqs >= FMIN) & (nfreqs <= FMAX)
+    # the one-sided spectrum is not doubled at DC and Nyquist
+    edges = (nfreqs == 0) | ((n_samples % 2 == 0) &
+                             (np.arange(len(nfreqs)) == len(nfreqs) - 1))
+    return dict(tapers=tapers,
+                weights=2 * ratios / ratios.sum() / sfreq,
+                freq_mask=freq_mask,
+                freq_scale=np.where(edges, 0.5, 1)[freq_mask],
+                nfreqs=nfreqs[freq_mask])
+
+
+def _save_tapers(fname, tapers, ratios):
+    """Save DPSS tapers under a temporary name and rename it when complete.
+
+    The temporary name is unique to the process, so that workers computing
+    the same tapers do not write to the same file and readers never see a
+    partial file. The cache is optional, a failed write is ignored.
+    """
+    temp_fname = fname.with_name(f'{fname.name}.{os.getpid()}.tmp')
+    try:
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_fname, 'wb') as f:
+            np.savez(f, tapers=tapers, ratios=ratios)
+        os.replace(temp_fname, fname)
+    except OSError:
+        temp_fname.unlink(missing_ok=True)
+
+
+def compute_welch_psd(data, sfreq, config):
+    """Compute the Welch PSD of overlapping epochs from shared segments.
+
+    The continuous data is cut into Hann-windowed segments of
+    config['welch_segment_length'] seconds, starting every epoch step
+    (see get_epoch_windows). The periodogram of each segment is computed
+    once, and the PSD of an epoch is the mean over the segments it
+    contains. This equals scipy.signal.welch on each epoch, but with the
+    configured overlap most segment spectra are shared by several epochs.
+
+    Parameters
+    ----------
+    data : array, shape (n_channels, n_times)
+        Continuous data.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    psds : array, shape (n_epochs, n_channels, n_freqs)
+        Power spectral density of each epoch.
+    nfreqs : array, shape (n_freqs, )
+        Frequencies of the PSD.
+    """
+    n_samples, step = get_epoch_step(sfreq, config)
+    n_per_seg = int(round(config['welch_segment_length'] * sfreq))
+    if n_per_seg > n_samples or (n_samples - n_per_seg) % step:
+        raise ValueError('The epoch length minus the Welch segment length '
+                         'must be a multiple of the epoch step.')
+
+    window = get_window('hann', n_per_seg)
+    nfreqs = np.fft.rfftfreq(n_per_seg, 1 / sfreq)
+    keep = (nfreqs >= FMIN) & (nfreqs <= FMAX)
+    # one-sided density, the DC and Nyquist bins are not doubled
+    scale = np.where((nfreqs == 0) | (nfreqs == sfreq / 2), 1, 2)[keep]
+    scale = scale / (sfreq * (window**2).sum())
+
+    segments = sliding_window_view(data, n_per_seg, axis=-1)[:, ::step]
+    segment_psds = np.empty((segments.shape[1], len(data), keep.sum()))
+    batch_size = config['psd_batch_size']
+    for start in range(0, segments.shape[1], batch_size):
+        batch = segments[:, start:start + batch_size]
+        batch = batch - batch.mean(axis=-1, keepdims=True)
+        spectrum = np.fft.rfft(batch * window, axis=-1)[..., keep]
+        segment_psds[start:start + batch_size] = np.swapaxes(
+            (spectrum.real**2 + spectrum.imag**2) * scale, 0, 1)
+
+    # average the segments of each epoch
+    n_segments = (n_samples - n_per_seg) // step + 1
+    psds = sliding_window_view(segment_psds, n_segments, axis=0).mean(axis=-1)
+    return psds, nfreqs[keep]
+
+
+def get_block_size(n_channels, sfreq, config):
+    """Number of epochs of a block fitting config['psd_memory_budget'].
+
+    A block of epochs holds its share of the continuous data (one epoch
+    step per epoch), the PSD of its epochs and the working memory of the
+    PSD computation (about _WORK_FACTOR float64 copies of each epoch). This
+    is a rough estimate, the budget (in MB) is not a hard limit.
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary.
+
+    Returns
+    -------
+    block_size : int
+        Number of epochs per block, at least 1.
+    """
+    n_samples, step = get_epoch_step(sfreq, config)
+    n_freqs = (FMAX - FMIN) * config['epoch_length'] + 1
+    epoch_bytes = 8 * n_channels * (step + n_freqs + _WORK_FACTOR * n_samples)
+    budget = config['psd_memory_budget'] * 2**20
+    return max(int(budget // epoch_bytes), 1)
+
+
+def get_epoch_blocks(n_times, n_channels, sfreq, config):
+    """Blocks of epochs fitting config['psd_memory_budget'].
+
+    Returns
+    -------
+    blocks : list of tuples
+        First and last (excluded) epoch of each block, and the first and
+        last (excluded) sample of the continuous data it covers.
+    """
+    n_samples, step = get_epoch_step(sfreq, config)
+    n_epochs = get_n_epochs(n_times, sfreq, config)
+    block_size = get_block_size(n_channels, sfreq, config)
+    return [(start, min(start + block_size, n_epochs), start * step,
+             (min(start + block_size, n_epochs) - 1) * step + n_samples)
+            for start in range(0, n_epochs, block_size)]
+
+
+def iter_psd_blocks(read,
+                    n_times,
+                    n_channels,
+                    sfreq,
+                    config,
+                    n_jobs=6,
+                    bad_epochs=None,
+                    bad_channels=None):
+    """Compute the PSD of the overlapping epochs block by block.
+
+    Only the samples of a block of epochs (see get_block_size) are read and
+    kept in memory at a time. A block covers its epochs exactly, so the
+    PSD of each epoch is the one compute_psd returns on the whole data,
+    with both the multitaper and the Welch method.
+
+    Parameters
+    ----------
+    read : function
+        Called as read(start, stop), returns the samples start to stop of
+        the continuous data as an array of shape (n_channels, stop - start).
+    n_times : int
+        Number of samples of the continuous data.
+    n_channels : int
+        Number of channels.
+    sfreq : float
+        Sampling frequency of the data.
+    config : dict
+        Configuration dictionary.
+    n_jobs : int
+        Number of jobs of the multitaper method.
+    bad_epochs : array of bool, shape (n_epochs, ) | None
+        Epochs of the whole data whose PSD is not computed (left as NaN),
+        e.g. found with features.artifacts.get_block_statistics.
+    bad_channels : array of bool, shape (n_channels, ) | None
+        Channels whose PSD is not computed (left as NaN).
+
+    Yields
+    ------
+    start : int
+        Index of the first epoch of the block.
+    psds : array, shape (n_block_epochs, n_channels, n_freqs)
+        Power spectral density of each epoch of the block.
+    nfreqs : array, shape (n_freqs, )
+        Frequencies of the PSD.
+    """
+    n_samples, step = get_epoch_step(sfreq, config)
+    for start, stop, first, last in get_epoch_blocks(n_times, n_channels,
+                                                     sfreq, config):
+        block_bad = None if bad_epochs is None else bad_epochs[start:stop]
+        if block_bad is not None and block_bad.all():
+            # only the first epoch is read, for the shape of the PSD
+            psds, nfreqs = compute_psd(read(first, first + n_samples),
+                                       sfreq,
+                                       config,
+                                       n_jobs=n_jobs,
+                                       bad_channels=bad_channels)
+            yield start, np.full((stop - start, ) + psds.shape[1:],
+                                 np.nan), nfreqs
+            continue
+        psds, nfreqs = compute_psd(read(first, last),
+                                   sfreq,
+                                   config,
+                                   n_jobs=n_jobs,
+                                   bad_epochs=block_bad,
+                                   bad_channels=bad_channels)
+        yield start, psds, nfreqs
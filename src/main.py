@@ -1,15 +1,133 @@
 import yaml
 from pathlib import Path
 
-from data.create_data import create_eeg_data
+from utils import (configure_profiling, skip_run, use_headless_backend,
+                   write_profile_report)
 
-from utils import skip_run
+# the blocks run only when main.py is the entry point: the process pools
+# of the pipeline and the benchmarks may start their workers with spawn,
+# which imports the main module again in each worker
+if __name__ == '__main__':
+    # the modules of each block are imported in the block, so that skipped
+    # blocks do not import mne, matplotlib or pyxdf
+    use_headless_backend()
+    config_path = Path(__file__).parents[1] / 'src/config.yml'
+    config = yaml.load(open(str(config_path)), Loader=yaml.SafeLoader)
+    configure_profiling(config)
 
-config_path = Path(__file__).parents[1] / 'src/config.yml'
-config = yaml.load(open(str(config_path)), Loader=yaml.SafeLoader)
+    with skip_run('run', 'Create EEG data') as check, check():
+        from data.create_data import EEG_STAGES
+        from pipeline import run_pipeline
 
-with skip_run('run', 'Create EEG data') as check, check():
-    create_eeg_data(config)
+        # only the stages whose config keys or files changed are recomputed
+        run_pipeline(config, EEG_STAGES, ['features'])
 
-with skip_run('run', 'Create EEG data') as check, check():
-    create_eeg_data(config)
\ No newline at end of file
+    with skip_run('skip', 'Export engagement and workload') as check, check():
+        from data.export import export_features, read_exported_features
+
+        fname = export_features(config)
+        # e.g. minutes 10 to 20 of the midline channels of the first subject
+        selection = read_exported_features(fname,
+                                           config['subjects'][0],
+                                           channels=['Fz', 'Cz', 'Pz'],
+                                           tmin=600,
+                                           tmax=1200,
+                                           columns=['engagement', 'workload'])
+        print(f"{len(selection['times'])} epochs of {selection['ch_names']}")
+
+    with skip_run('skip', 'Cohort engagement and workload') as check, check():
+        from data.cohort import create_cohort_features, get_group_statistics
+
+        statistics = get_group_statistics(create_cohort_features(config))
+        for name, values in statistics.items():
+            print(f"{name}: {values['group_mean'].mean():.3f} "
+                  f"(+/- {values['group_std'].mean():.3f})")
+
+    with skip_run('skip',
+                  'Synchronize EEG, markers and force') as check, check():
+        from data.sync import create_synchronized_data
+
+        for subject in config['subjects']:
+            aligned = create_synchronized_data(config, subject)
+            print(f"S_{subject}: {len(aligned['times'])} samples, "
+                  f"{len(aligned['markers']['times'])} markers")
+
+    with skip_run('skip', 'Epoch around game events') as check, check():
+        from features.events import create_event_epochs
+
+        for subject in config['subjects']:
+            event_epochs = create_event_epochs(config, subject)
+            for description, events in event_epochs['events'].items():
+                print(f"S_{subject} {description}: "
+                      f"{len(events['epochs'])} epochs")
+
+    with skip_run('skip', 'Animate engagement and workload') as check, check():
+        from visualization.visualize import animate
+
+        for subject in config['subjects']:
+            animate(config, subject)
+
+    with skip_run('skip', 'Replay the online monitor') as check, check():
+        from features.online import XdfReplaySource, run_online_monitor
+
+        subject = config['subjects'][0]
+        source = XdfReplaySource(config['raw_eeg_path'] + 'S_' + subject +
+                                 '/eeg.xdf')
+        run_online_monitor(source, config)
+
+    with skip_run('skip', 'Benchmark XDF reader') as check, check():
+        from benchmarks.xdf_reader import benchmark_xdf_reader
+
+        subject = config['subjects'][0]
+        benchmark_xdf_reader(config['raw_eeg_path'] + 'S_' + subject +
+                             '/eeg.xdf')
+
+    with skip_run('skip',
+                  'Benchmark XDF decoding throughput') as check, check():
+        from benchmarks.xdf_reader import benchmark_decoding_throughput
+
+        subject = config['subjects'][0]
+        benchmark_decoding_throughput(config['raw_eeg_path'] + 'S_' + subject +
+                                      '/eeg.xdf')
+
+    with skip_run('skip', 'Benchmark compressed XDF') as check, check():
+        from benchmarks.xdf_reader import benchmark_compressed_xdf
+
+        subject = config['subjects'][0]
+        benchmark_compressed_xdf(config['raw_eeg_path'] + 'S_' + subject +
+                                 '/eeg.xdf')
+
+    with skip_run('skip', 'Benchmark parallel subjects') as check, check():
+        from benchmarks.pipeline import benchmark_create_eeg_data
+
+        benchmark_create_eeg_data(config)
+
+    with skip_run('skip', 'Benchmark band ratios') as check, check():
+        from benchmarks.features import benchmark_band_ratios
+
+        benchmark_band_ratios(config)
+
+    with skip_run('skip', 'Benchmark PSD methods') as check, check():
+        from benchmarks.features import benchmark_psd_methods
+
+        benchmark_psd_methods(config)
+
+    with skip_run('skip', 'Benchmark multitaper kernel') as check, check():
+        from benchmarks.features import benchmark_multitaper_kernel
+
+        benchmark_multitaper_kernel(config)
+
+    with skip_run('skip', 'Benchmark suite') as check, check():
+        from benchmarks.suite import (compare_benchmark_runs,
+                                      run_benchmark_suite)
+
+        run_benchmark_suite(config)
+        compare_benchmark_runs()
+
+    with skip_run('skip', 'Benchmark import time') as check, check():
+        from benchmarks.startup import benchmark_import_time, check_import_time
+
+        benchmark_import_time()
+        check_import_time()
+
+    write_profile_report(config)
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from utils import add_profile_records, pop_profile_records, profile_stage
+
+logger = logging.getLogger()
+
+
+class Stage(object):
+    """A step of the pipeline and everything its result depends on.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    func : function
+        Called as func(config, subject, *upstream_results) and returns the
+        result of the stage.
+    inputs : list of str
+        Names of the upstream stages whose results are passed to func.
+    config_keys : list of str
+        Config keys the result depends on.
+    files : function | None
+        Called as files(config, subject), returns the source files the
+        result depends on.
+    persist : bool
+        If True, the result is pickled to the cache, otherwise it is
+        recomputed whenever a downstream stage needs it.
+    check : function | None
+        Called as check(config, subject, result) on a persisted result
+        whose fingerprint is unchanged, returns False if it can no longer
+        be used (e.g. it refers to data stored elsewhere, which was
+        deleted or overwritten).
+    version : int
+        Bump it when the code of the stage changes its result.
+
+    """
+    def __init__(self,
+                 name,
+                 func,
+                 inputs=(),
+                 config_keys=(),
+                 files=None,
+                 persist=True,
+                 check=None,
+                 version=1):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.config_keys = list(config_keys)
+        self.files = files
+        self.persist = persist
+        self.check = check
+        self.version = version
+
+
+class Pipeline(object):
+    """Run stages of a subject, recomputing only what changed.
+
+    The fingerprint of a stage hashes its version, the values of its config
+    keys, the size and modification time of its source files and the
+    fingerprints of its upstream stages. A persisted result is reused as
+    long as its fingerprint is unchanged (and the check of its stage, if
+    any, passes), so changing e.g. config['freq_bands'] only recomputes the
+    stages depending on it.
+
+    Parameters
+    ----------
+    stages : list of Stage
+        Stages of the pipeline.
+    config : dict
+        Configuration dictionary.
+    cache_path : str
+        Folder of the persisted results (one pickle per stage and subject).
+
+    """
+    def __init__(self, stages, config, cache_path):
+        self.stages = {stage.name: stage for stage in stages}
+        self.config = config
+        self.cache_path = Path(cache_path)
+
+    def fingerprint(self, name, subject):
+        """Fingerprint of the result of a stage for a subject."""
+        stage = self.stages[name]
+        files = stage.files(self.config, subject) if stage.files else []
+        key = dict(
+            stage=name,
+            version=stage.version,
+            subject=subject,
+            config={k: self.config[k]
+                    for k in stage.config_keys},
+            files=[[str(fname), *_file_signature(fname)] for fname in files],
+            inputs=[self.fingerprint(i, subject) for i in stage.inputs])
+        return hashlib.sha1(json.dumps(key, sort_keys=True,
+                                       default=str).encode()).hexdigest()
+
+    def _cache_fname(self, name, subject):
+        return self.cache_path / name / f'S_{subject}.pkl'
+
+    def run(self, name, subject, results=None):
+        """Get the result of a stage, computing the stale stages it needs.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        subject : str
+            Subject ID.
+        results : dict | None
+            Results of the stages already computed in this run.
+
+        Returns
+        -------
+        result : object
+            Result of the stage.
+        """
+        results = {} if results is None else results
+        if name in results:
+            return results[name]
+        stage = self.stages[name]
+        fingerprint = self.fingerprint(name, subject)
+        cache_fname = self._cache_fname(name, subject)
+        if stage.persist and cache_fname.exists():
+            with open(cache_fname, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['fingerprint'] == fingerprint and (
+                    stage.check is None
+                    or stage.check(self.config, subject, cached['result'])):
+                print(f'S_{subject} {name}: up to date')
+                results[name] = cached['result']
+                return results[name]
+
+        upstream = [self.run(i, subject, results) for i in stage.inputs]
+        print(f'S_{subject} {name}: computing')
+        with profile_stage(name, subject=subject):
+            results[name] = stage.func(self.config, subject, *upstream)
+        if stage.persist:
+            cache_fname.parent.mkdir(parents=True, exist_ok=True)
+            temp_fname = cache_fname.with_name(cache_fname.name + '.tmp')
+            with open(temp_fname, 'wb') as f:
+                pickle.dump(dict(fingerprint=fingerprint,
+                                 result=results[name]),
+                            f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_fname, cache_fname)
+        return results[name]
+
+
+def _file_signature(fname):
+    """Size and modification time of a file, None if it does not exist."""
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _run_targets(pipeline, subject, targets):
+    """Run the target stages of a subject."""
+    computed = {}
+    for target in targets:
+        pipeline.run(target, subject, computed)
+    return {target: computed[target] for target in targets}
+
+
+def _run_subject(pipeline, subject, targets):
+    """Run the targets of a subject in a worker, returning its records too."""
+    return _run_targets(pipeline, subject, targets), pop_profile_records()
+
+
+def run_pipeline(config, stages, targets):
+    """Run the target stages for all subjects.
+
+    With config['n_workers'] > 1 the subjects are processed in parallel by a
+    pool of processes sharing the lock of the HDF5 interim store (see
+    data.create_data.create_eeg_data). A subject whose stages fail is
+    logged and skipped, the remaining subjects are still processed. The
+    stages must be picklable (module level functions).
+
+    Under the spawn and forkserver start methods (the default on macOS and
+    Windows, and on Linux from Python 3.14) the workers import the main
+    module again, so the pool must be started from a script guarded by
+    `if __name__ == '__main__':` (see main.py).
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary, the results are cached in
+        config['pipeline_cache_path'].
+    stages : list of Stage
+        Stages of the pipeline.
+    targets : list of str
+        Names of the stages to bring up to date.
+
+    Returns
+    -------
+    results : dict
+        Results of the target stages of each subject, keyed by
+        'S_<subject>'.
+    """
+    pipeline = Pipeline(stages, config, config['pipeline_cache_path'])
+    subjects = config['subjects']
+    n_workers = min(config.get('n_workers', 1), len(subjects))
+    results = {}
+    if n_workers <= 1:
+        for subject in subjects:
+            try:
+                results['S_' + subject] = _run_targets(pipeline, subject,
+                                                       targets)
+            except Exception:
+                logger.exception(f'Failed to process subject S_{subject}')
+        return results
+
+    # imported here, data.create_data defines the stages of this pipeline
+    from data.create_data import _init_worker, get_worker_config
+
+    # the workers share the FFT jobs, n_jobs does not change the results
+    pipeline = Pipeline(stages, get_worker_config(config, n_workers),
+                        config['pipeline_cache_path'])
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_worker,
+                             initargs=(multiprocessing.Lock(), )) as executor:
+        futures = {
+            executor.submit(_run_subject, pipeline, subject, targets): subject
+            for subject in subjects
+        }
+        for future in as_completed(futures):
+            subject = futures[future]
+            try:
+                results['S_' + subject], records = future.result()
+                add_profile_records(records)
+            except Exception:
+                logger.exception(f'Failed to process subject S_{subject}')
+    return results
@@ -1,4 +1,24 @@
+import cProfile
+import csv
+import json
+import os
+import re
+import sys
+import time
 from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# records of the stages run in this process, see profile_stage
+_profile_records = []
+_profile_stack = []
+# peak RSS of each open stage before the last reset, see profile_stage
+_profile_peaks = []
+_profile_settings = dict(profile=False, profile_path='reports/profiles/')
 
 
 class skip(object):
@@ -29,6 +49,9 @@ class SkipWith(Exception):
 def skip_run(flag, f):
     """To skip a block of code.
 
+    A block that runs is recorded as a stage (see profile_stage) and, if
+    profiling is enabled in the config, run under cProfile.
+
     Parameters
     ----------
     flag : str
@@ -47,9 +70,223 @@ def skip_run(flag, f):
             raise SkipWith()
         else:
             print('Running the block: ' + f)
-            yield
+            with profile_stage(f, cprofile=True):
+                yield
 
     try:
         yield check_active
     except SkipWith:
         pass
+
+
+def use_headless_backend():
+    """Select the non-interactive Agg backend of matplotlib without display.
+
+    The backend is set through MPLBACKEND, so matplotlib is not imported
+    here and worker processes inherit it. An explicit MPLBACKEND is kept.
+
+    Returns
+    -------
+    headless : bool
+        True if no display was found.
+    """
+    headless = sys.platform.startswith('linux') and not (
+        os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    if headless:
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+    return headless
+
+
+def configure_profiling(config):
+    """Enable cProfile for the skip_run blocks from the configuration.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary, config['profile'] enables cProfile and
+        config['profile_path'] is the folder of the profiles and reports.
+    """
+    _profile_settings.update(profile=config.get('profile', False),
+                             profile_path=config.get('profile_path',
+                                                     'reports/profiles/'))
+
+
+def _peak_rss():
+    """Peak resident set size of the current process in MB.
+
+    On Linux the peak is the one since the last _reset_peak_rss. None if
+    unknown (Windows).
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def _reset_peak_rss():
+    """Reset the peak resident set size to the current one (Linux only).
+
+    Returns
+    -------
+    reset : bool
+        Whether the peak was reset, otherwise it stays the peak of the
+        process lifetime.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss(*values):
+    """Largest of peak RSS values, ignoring unknown (None) ones."""
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _bytes_read():
+    """Number of bytes read by the current process (None if unknown)."""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+@contextmanager
+def profile_stage(stage, cprofile=False, **fields):
+    """Record the wall time, CPU time, peak RSS and bytes read of a stage.
+
+    Stages can be nested, the record of a stage holds the names of the
+    enclosing stages in "path". Records are kept in this process until
+    pop_profile_records or write_profile_report is called.
+
+    On Linux, the peak RSS is reset when a stage starts (see
+    _reset_peak_rss), so that it is the peak during the stage (including
+    its nested stages). Elsewhere it is the peak of the process up to the
+    end of the stage.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    cprofile : bool
+        If True and profiling is enabled (see configure_profiling), the
+        stage is run under cProfile and the statistics are dumped to
+        <profile_path>/<stage>.prof. Only the outermost stages should be
+        profiled, cProfile cannot be nested.
+    **fields
+        Additional fields of the record (e.g. subject).
+    """
+    profiler = None
+    if cprofile and _profile_settings['profile']:
+        profiler = cProfile.Profile()
+    _profile_stack.append(stage)
+    # the record is added first so that stages are listed in order
+    record = dict(stage=stage, path='/'.join(_profile_stack), **fields)
+    _profile_records.append(record)
+    # the peak so far belongs to the enclosing stages, which keep it
+    peak = _peak_rss()
+    _profile_peaks[:] = [_max_rss(p, peak) for p in _profile_peaks]
+    _profile_peaks.append(None if _reset_peak_rss() else peak)
+    bytes_read = _bytes_read()
+    start, start_cpu = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        end_bytes_read = _bytes_read()
+        record.update(wall_time=time.perf_counter() - start,
+                      cpu_time=time.process_time() - start_cpu,
+                      peak_rss=_max_rss(_profile_peaks.pop(), _peak_rss()),
+                      bytes_read=None if bytes_read is None else
+                      end_bytes_read - bytes_read)
+        _profile_stack.pop()
+        if profiler is not None:
+            profile_path = Path(_profile_settings['profile_path'])
+            profile_path.mkdir(parents=True, exist_ok=True)
+            slug = re.sub(r'\W+', '_', stage).strip('_').lower()
+            profiler.dump_stats(profile_path / f'{slug}.prof')
+
+
+def reset_profiling():
+    """Forget the stages inherited from a parent process (in a worker)."""
+    _profile_records.clear()
+    _profile_stack.clear()
+    _profile_peaks.clear()
+
+
+def pop_profile_records():
+    """Return and clear the stage records of this process."""
+    records = list(_profile_records)
+    _profile_records.clear()
+    return records
+
+
+def add_profile_records(records):
+    """Add stage records of another process under the current stage.
+
+    CPU time and peak RSS of the records are the ones of the process they
+    were recorded in.
+    """
+    for record in records:
+        path = '/'.join(_profile_stack + [record['path']])
+        _profile_records.append(dict(record, path=path))
+
+
+def write_profile_report(config, fname=None):
+    """Write the stage records of this run to a JSON or CSV file.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary, the report is written to
+        config['profile_path'] if fname is None.
+    fname : str | None
+        Name of the report, its suffix (.json or .csv) selects the format.
+        If None, run_<date>.json is used.
+
+    Returns
+    -------
+    records : list of dicts
+        The stage records.
+    """
+    records = pop_profile_records()
+    if fname is None:
+        fname = Path(config.get('profile_path', 'reports/profiles/')) / \
+            time.strftime('run_%Y%m%d_%H%M%S.json')
+    fname = Path(fname)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    if fname.suffix == '.csv':
+        fieldnames = list(dict.fromkeys(key for record in records
+                                        for key in record))
+        with open(fname, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(fname, 'w') as f:
+            json.dump(records, f, indent=2)
+
+    for record in records:
+        depth = record['path'].count('/')
+        print(f"{'  ' * depth}{record['stage']}: "
+              f"{record['wall_time']:.2f} s (CPU {record['cpu_time']:.2f} s)"
+              + ('' if record['peak_rss'] is None else
+                 f", peak RSS {record['peak_rss']:.0f} MB"))
+    return records
@@ -0,0 +1,152 @@
+import functools
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import mne
+import numpy as np
+from matplotlib.animation import FuncAnimation
+from matplotlib.figure import Figure
+
+from data.utils import load_features
+from features.psd import get_epoch_step
+
+
+@functools.lru_cache(maxsize=8)
+def get_topomap_geometry(ch_names, montage, res=64):
+    """Interpolation matrix of the topomaps of a set of channels.
+
+    The topomap interpolation of mne.viz.plot_topomap (with the default
+    cubic interpolation and border='mean') is linear in the channel values,
+    so the image of any values is the product of a matrix with the values.
+    The matrix is computed once per channels and montage by interpolating
+    each unit vector.
+
+    Parameters
+    ----------
+    ch_names : tuple of str
+        Channel names.
+    montage : str
+        Name of the montage of the channels.
+    res : int
+        Resolution of the topomap image.
+
+    Returns
+    -------
+    matrix : array, shape (res * res, n_channels)
+        Interpolation matrix, NaN outside of the interpolated area.
+    """
+    info = mne.create_info(list(ch_names), sfreq=1.0, ch_types='eeg')
+    info.set_montage(montage)
+    ax = Figure().add_subplot()
+    columns = []
+    for values in np.eye(len(ch_names)):
+        image, contours = mne.viz.plot_topomap(values,
+                                               pos=info,
+                                               axes=ax,
+                                               res=res,
+                                               contours=0,
+                                               sensors=False,
+                                               show=False)
+        columns.append(np.ma.filled(image.get_array(), np.nan).ravel())
+        ax.clear()
+    return np.stack(columns, axis=1)
+
+
+def _color_limits(values):
+    """Color limits of plot_topomap for values (vmin=vmax=None)."""
+    if values.min() >= 0:
+        return 0, values.max()
+    return -np.abs(values).max(), np.abs(values).max()
+
+
+def animate(config, subject, fname=None, speed=1.0, res=64):
+    """Animate the engagement and workload topomaps of a subject.
+
+    The features are read from the HDF5 interim store, so they have to be
+    computed first (see create_eeg_data). The head outlines and sensors are
+    drawn once, and each frame only updates the image data of both
+    topomaps (a product with the matrix of get_topomap_geometry) and
+    redraws them with blitting. Contour lines are not drawn as they would
+    have to be recomputed every frame. Bad channels are left out and bad
+    epochs are skipped (see features.artifacts.find_artifacts).
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary.
+    subject : str
+        Subject ID.
+    fname : str | None
+        If given, the animation is rendered without a display and saved to
+        this file (.gif with Pillow, other formats with ffmpeg), otherwise
+        it is shown.
+    speed : float
+        Playback speed, 1 plays the epochs in real time.
+    res : int
+        Resolution of the topomap images.
+
+    Returns
+    -------
+    animation : matplotlib.animation.FuncAnimation
+        The animation.
+    """
+    features = load_features(config, subject)
+    if features is None:
+        raise ValueError(f'No features stored for subject S_{subject}')
+    n_epochs, n_channels = features['engagement'].shape
+    channels = ~features.get('bad_channels', np.zeros(n_channels, bool))
+    frames = np.flatnonzero(~features.get('bad_epochs',
+                                          np.zeros(n_epochs, bool)))
+    ch_names = [ch for ch, good in zip(features['ch_names'], channels) if good]
+    matrix = get_topomap_geometry(tuple(ch_names), config['montage'], res)
+    plt.rcParams.update({'font.size': 22})
+    labels = [r'$\beta/(\alpha + \theta)$', r'$\theta/(\alpha)$']
+    title = ['Engagement', 'Workload']
+    names = ['engagement', 'workload']
+    info = mne.create_info(ch_names,
+                           sfreq=config['sfreq'],
+                           ch_types='eeg')
+    info.set_montage(config['montage'])
+
+    if fname is None:
+        fig, ax = plt.subplots(1, 2, figsize=[10, 5])
+    else:
+        fig = Figure(figsize=[10, 5])
+        ax = fig.subplots(1, 2)
+    images = []
+    for i in range(len(labels)):
+        image, contours = mne.viz.plot_topomap(features[names[i]][frames[0],
+                                                                  channels],
+                                               pos=info,
+                                               axes=ax[i],
+                                               res=res,
+                                               contours=0,
+                                               show=False,
+                                               cmap='viridis')
+        image.set_animated(True)
+        images.append(image)
+        ax[i].set_ylabel(labels[i])
+        ax[i].title.set_text(title[i])
+    time_text = fig.text(0.5, 0.02, '', ha='center', animated=True)
+
+    def update(epoch):
+        for image, name in zip(images, names):
+            values = features[name][epoch, channels]
+            image.set_data((matrix @ values).reshape(res, res))
+            image.set_clim(*_color_limits(values))
+        time_text.set_text(f"{features['times'][epoch]:.2f} s")
+        return images + [time_text]
+
+    n_samples, step = get_epoch_step(config['sfreq'], config)
+    interval = step / config['sfreq'] / speed
+    animation = FuncAnimation(fig,
+                              update,
+                              frames=frames,
+                              interval=interval * 1e3,
+                              blit=True)
+    if fname is None:
+        plt.show()
+    else:
+        writer = 'pillow' if Path(fname).suffix == '.gif' else 'ffmpeg'
+        animation.save(fname, writer=writer, fps=1 / interval)
+    return animation
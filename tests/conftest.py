@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules of src import each other as top-level packages (see main.py)
+sys.path.insert(0, str(Path(__file__).parents[1] / 'src'))
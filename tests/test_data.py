@@ -0,0 +1,207 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+import pyxdf
+
+from benchmarks.synthetic import (_chunk, _stream_header, _varlen,
+                                  write_synthetic_xdf)
+from data.mne_import_xdf import (load_index, open_xdf, read_raw_xdf,
+                                 read_stream)
+from data.raw_memmap import read_raw_xdf_memmap
+from data.sync import align_streams
+
+
+def _read_streams(fname, tmin=None, tmax=None):
+    """Read all streams of an XDF file with read_stream, keyed by ID."""
+    index, infos = load_index(fname)
+    with open_xdf(fname) as f:
+        return {
+            info['stream_id']: read_stream(f, index, info, tmin, tmax)
+            for info in infos
+        }
+
+
+def _load_pyxdf(fname):
+    """Read all streams of an XDF file with pyxdf, keyed by ID."""
+    streams, header = pyxdf.load_xdf(str(fname),
+                                     synchronize_clocks=False,
+                                     dejitter_timestamps=False)
+    return {stream['info']['stream_id']: stream for stream in streams}
+
+
+def _assert_same_stream(stream, expected, atol=0):
+    np.testing.assert_allclose(stream['time_stamps'],
+                               expected['time_stamps'],
+                               rtol=0,
+                               atol=atol)
+    if stream['time_series'].dtype == object:
+        assert stream['time_series'].tolist() == list(
+            map(list, expected['time_series']))
+    else:
+        np.testing.assert_array_equal(stream['time_series'],
+                                      expected['time_series'])
+
+
+def _mixed_samples(stream_id, time_stamps, data):
+    """Encode a Samples chunk, samples with a NaN time stamp have none."""
+    content = [struct.pack('<I', stream_id), _varlen(len(data))]
+    for time_stamp, values in zip(time_stamps, data):
+        if np.isnan(time_stamp):
+            content.append(b'\x00')
+        else:
+            content += [b'\x08', struct.pack('<d', time_stamp)]
+        content.append(values.tobytes())
+    return _chunk(3, b''.join(content))
+
+
+@pytest.fixture(scope='module')
+def synthetic_xdf(tmp_path_factory):
+    fname = tmp_path_factory.mktemp('xdf') / 'eeg.xdf'
+    return write_synthetic_xdf(fname, n_channels=8, duration=20)
+
+
+def test_read_stream_matches_pyxdf(synthetic_xdf):
+    """Fixed-layout numeric chunks and string chunks decode as in pyxdf."""
+    streams = _read_streams(synthetic_xdf)
+    expected = _load_pyxdf(synthetic_xdf)
+    assert streams.keys() == expected.keys()
+    for stream_id, stream in streams.items():
+        _assert_same_stream(stream, expected[stream_id])
+    assert streams[2]['time_series'].dtype == object
+
+
+def test_read_stream_mixed_time_stamps(tmp_path):
+    """Chunks mixing samples with and without time stamps."""
+    rng = np.random.default_rng(0)
+    sfreq, n_samples = 100, 10
+    fname = tmp_path / 'mixed.xdf'
+    with open(fname, 'wb') as f:
+        f.write(b'XDF:')
+        f.write(_chunk(1, b'<?xml version="1.0"?><info><version>1.0'
+                       b'</version></info>'))
+        f.write(_stream_header(1, 'Mixed', 'EEG', ['a', 'b'], sfreq, 'int16'))
+        for start, layout in enumerate(['all', 'mixed', 'none', 'first']):
+            time_stamps = 10 + (start * n_samples +
+                                np.arange(n_samples)) / sfreq
+            if layout == 'mixed':
+                time_stamps[1::3] = np.nan
+            elif layout == 'none':
+                time_stamps[:] = np.nan
+            elif layout == 'first':
+                time_stamps[1:] = np.nan
+            data = rng.integers(-100, 100, (n_samples, 2), dtype='<i2')
+            f.write(_mixed_samples(1, time_stamps, data))
+
+    stream = _read_streams(fname)[1]
+    # pyxdf accumulates the deduced time stamps sample by sample
+    _assert_same_stream(stream, _load_pyxdf(fname)[1], atol=1e-9)
+    assert stream['time_series'].dtype == np.int16
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'block_gzip'])
+def test_compressed_xdf(tmp_path, synthetic_xdf, compression):
+    """Compressed files decode to the same streams as the plain file."""
+    fname = write_synthetic_xdf(tmp_path / 'eeg.xdfz',
+                                n_channels=8,
+                                duration=20,
+                                compression=compression)
+    streams = _read_streams(fname)
+    expected = _read_streams(synthetic_xdf)
+    for stream_id, stream in streams.items():
+        _assert_same_stream(stream, expected[stream_id])
+
+
+@pytest.mark.parametrize('tmin, tmax', [(1005.0, 1010.0), (None, 1002.5),
+                                        (1017.3, None), (1003.01, 1003.02)])
+def test_read_stream_time_range(synthetic_xdf, tmin, tmax):
+    """tmin and tmax select the same samples as slicing the whole stream."""
+    streams = _read_streams(synthetic_xdf, tmin, tmax)
+    for stream_id, stream in _read_streams(synthetic_xdf).items():
+        time_stamps = stream['time_stamps']
+        keep = np.ones(len(time_stamps), dtype=bool)
+        if tmin is not None:
+            keep &= time_stamps >= tmin
+        if tmax is not None:
+            keep &= time_stamps <= tmax
+        _assert_same_stream(
+            streams[stream_id],
+            dict(time_stamps=time_stamps[keep],
+                 time_series=stream['time_series'][keep]))
+
+
+def test_truncated_xdf(tmp_path, synthetic_xdf):
+    """A truncated file is read up to its last complete chunk."""
+    fname = tmp_path / 'truncated.xdf'
+    content = synthetic_xdf.read_bytes()
+    fname.write_bytes(content[:-5000])
+    streams = _read_streams(fname)
+    expected = _load_pyxdf(fname)
+    assert 0 < len(streams[1]['time_stamps']) < 20 * 500
+    for stream_id, stream in streams.items():
+        _assert_same_stream(stream, expected[stream_id])
+
+
+@pytest.mark.parametrize('dtype, rtol', [('float64', 0), ('float32', 1e-6)])
+def test_raw_memmap_matches_read_raw_xdf(tmp_path, synthetic_xdf, dtype,
+                                         rtol):
+    """The memory-mapped raw holds the data and markers of read_raw_xdf."""
+    memmap_fname = tmp_path / 'eeg.dat'
+    expected = read_raw_xdf(synthetic_xdf)
+    for _ in range(2):  # decoded, then reused
+        raw = read_raw_xdf_memmap(synthetic_xdf, memmap_fname, dtype=dtype)
+        assert raw.ch_names == expected.ch_names
+        np.testing.assert_allclose(raw.get_data(),
+                                   expected.get_data(),
+                                   rtol=rtol)
+        np.testing.assert_allclose(raw.get_data(picks=[3, 1], start=100,
+                                                stop=2000),
+                                   expected.get_data(picks=[3, 1],
+                                                     start=100,
+                                                     stop=2000),
+                                   rtol=rtol)
+        np.testing.assert_array_equal(raw.annotations.onset,
+                                      expected.annotations.onset)
+        np.testing.assert_array_equal(raw.annotations.description,
+                                      expected.annotations.description)
+    # no temporary file left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'eeg.dat', 'eeg.dat.key'
+    ]
+
+
+def test_raw_memmap_changed_xdf(tmp_path, synthetic_xdf):
+    """The memory-mapped file is decoded again when the XDF file changes."""
+    fname = tmp_path / 'eeg.xdf'
+    memmap_fname = tmp_path / 'eeg.dat'
+    fname.write_bytes(synthetic_xdf.read_bytes())
+    read_raw_xdf_memmap(fname, memmap_fname, dtype='float64')
+    # same size and an older modification time, only the content differs
+    write_synthetic_xdf(fname, n_channels=8, duration=20, seed=1)
+    os.utime(fname, (0, 0))
+    raw = read_raw_xdf_memmap(fname, memmap_fname, dtype='float64')
+    np.testing.assert_array_equal(raw.get_data(),
+                                  read_raw_xdf(fname).get_data())
+
+
+@pytest.mark.parametrize('tmin, tmax', [(30.0, None), (3.0001, 3.0009)])
+def test_read_raw_xdf_empty_time_range(synthetic_xdf, tmin, tmax):
+    """A time range without samples is an error naming the recording span."""
+    with pytest.raises(ValueError, match='spans 0 to 19.99'):
+        read_raw_xdf(synthetic_xdf, tmin=tmin, tmax=tmax)
+
+
+def test_align_streams_last_marker():
+    """A marker after the last sample of the timeline is placed on it."""
+    stream = dict(info=dict(channels=[dict(label='a')]),
+                  time_stamps=np.array([0.0, 0.45, 0.9]),
+                  time_series=np.array([[0.0], [1.0], [2.0]]))
+    markers = dict(time_stamps=np.array([0.1, 0.9]),
+                   time_series=np.array([['start'], ['stop']], dtype=object))
+    aligned = align_streams(dict(a=stream), [markers], 4)
+    np.testing.assert_allclose(aligned['times'], [0, 0.25, 0.5, 0.75])
+    np.testing.assert_array_equal(aligned['markers']['samples'], [0, 3])
+    np.testing.assert_allclose(
+        aligned['a']['data'],
+        [[0, 0.25 / 0.45, 1 + 0.05 / 0.45, 1 + 0.3 / 0.45]])
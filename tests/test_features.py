@@ -0,0 +1,143 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import yaml
+from mne.time_frequency import psd_array_multitaper
+from scipy.signal import welch
+
+from benchmarks.synthetic import write_synthetic_xdf
+from data.create_data import (compute_eeg_features, get_band_ratios,
+                              get_engagement_workload)
+from data.mne_import_xdf import read_raw_xdf
+from features.online import XdfReplaySource, monitor_engagement_workload
+from features.psd import (FMAX, FMIN, compute_multitaper_psd, compute_psd,
+                          compute_welch_psd, get_block_size, get_epoch_step,
+                          get_epoch_windows, get_n_epochs, iter_psd_blocks)
+
+SFREQ = 500.0
+
+
+@pytest.fixture
+def config():
+    config_path = Path(__file__).parents[1] / 'src/config.yml'
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.SafeLoader)
+    # the tapers are not cached on disk during the tests
+    return dict(config, spectral_cache_path=None)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    times = np.arange(int(20 * SFREQ)) / SFREQ
+    alpha = np.sin(2 * np.pi * 10 * times)
+    return (rng.standard_normal((4, len(times))) + alpha) * 1e-5
+
+
+def test_multitaper_psd_matches_mne(data, config):
+    windows, step = get_epoch_windows(data, SFREQ, config)
+    psds, nfreqs = compute_multitaper_psd(windows, SFREQ, config, n_jobs=1)
+    expected, freqs = psd_array_multitaper(np.ascontiguousarray(windows),
+                                           SFREQ,
+                                           fmin=FMIN,
+                                           fmax=FMAX,
+                                           adaptive=False,
+                                           normalization='full',
+                                           verbose=False)
+    np.testing.assert_array_equal(nfreqs, freqs)
+    np.testing.assert_allclose(psds, expected, rtol=1e-12)
+
+
+def test_welch_psd_matches_scipy(data, config):
+    psds, nfreqs = compute_welch_psd(data, SFREQ, config)
+    windows, step = get_epoch_windows(data, SFREQ, config)
+    n_per_seg = int(round(config['welch_segment_length'] * SFREQ))
+    freqs, expected = welch(np.ascontiguousarray(windows),
+                            SFREQ,
+                            nperseg=n_per_seg,
+                            noverlap=n_per_seg - step,
+                            axis=-1)
+    keep = (freqs >= FMIN) & (freqs <= FMAX)
+    np.testing.assert_array_equal(nfreqs, freqs[keep])
+    np.testing.assert_allclose(psds, expected[..., keep], rtol=1e-12)
+
+
+@pytest.mark.parametrize('psd_method', ['multitaper', 'welch'])
+@pytest.mark.parametrize('rejection', [False, True])
+def test_psd_blocks_match_compute_psd(data, config, psd_method, rejection):
+    """The PSD computed block by block is the one of the whole data."""
+    # a budget of a few epochs per block
+    config = dict(config, psd_method=psd_method, psd_memory_budget=1)
+    n_epochs = get_n_epochs(data.shape[1], SFREQ, config)
+    bad_epochs = bad_channels = None
+    if rejection:
+        block_size = get_block_size(len(data), SFREQ, config)
+        bad_epochs = np.zeros(n_epochs, bool)
+        bad_epochs[[0, 3, n_epochs - 1]] = True
+        # all epochs of the second block
+        bad_epochs[block_size:2 * block_size] = True
+        bad_channels = np.array([False, True, False, False])
+    expected, nfreqs = compute_psd(data,
+                                   SFREQ,
+                                   config,
+                                   n_jobs=1,
+                                   bad_epochs=bad_epochs,
+                                   bad_channels=bad_channels)
+
+    def read(start, stop):
+        return data[:, start:stop]
+
+    blocks = list(
+        iter_psd_blocks(read,
+                        data.shape[1],
+                        len(data),
+                        SFREQ,
+                        config,
+                        n_jobs=1,
+                        bad_epochs=bad_epochs,
+                        bad_channels=bad_channels))
+    assert len(blocks) > 1
+    assert [start for start, _, _ in blocks] == list(
+        np.cumsum([0] + [len(psds) for _, psds, _ in blocks[:-1]]))
+    np.testing.assert_array_equal(
+        np.concatenate([psds for _, psds, _ in blocks]), expected)
+    np.testing.assert_array_equal(blocks[0][2], nfreqs)
+
+
+def test_band_ratios_match_engagement_workload(data, config):
+    psds, nfreqs = compute_psd(data, SFREQ, config, n_jobs=1)
+    band_ratios = get_band_ratios(psds, nfreqs, config['freq_bands'])
+    engagement, workload = get_engagement_workload(psds, nfreqs,
+                                                   config['freq_bands'])
+    np.testing.assert_allclose(band_ratios['engagement'],
+                               engagement,
+                               rtol=1e-12)
+    np.testing.assert_allclose(band_ratios['workload'], workload, rtol=1e-12)
+    assert band_ratios['band_powers'].shape == (
+        len(psds), len(data), len(config['freq_bands']))
+
+
+def test_online_monitor_matches_offline_features(tmp_path, config):
+    """The online updates are the features of the offline epochs."""
+    fname = write_synthetic_xdf(tmp_path / 'eeg.xdf',
+                                n_channels=8,
+                                duration=20)
+    config = dict(config, drop_channels=[], artifact_rejection=False)
+    features = compute_eeg_features(read_raw_xdf(fname), config)
+    # chunks of 20 samples, the epoch step is not a multiple of them
+    source = XdfReplaySource(fname, realtime=False)
+    updates = list(monitor_engagement_workload(source, config))
+    n_samples, step = get_epoch_step(source.sfreq, config)
+    assert step % source.chunk_size
+    assert len(updates) == len(features['times'])
+    np.testing.assert_allclose(
+        [update['engagement'] for update in updates],
+        features['engagement'],
+        rtol=1e-10)
+    np.testing.assert_allclose([update['workload'] for update in updates],
+                               features['workload'],
+                               rtol=1e-10)
+    ends = np.arange(len(updates)) * step + n_samples - 1
+    np.testing.assert_array_equal([update['time'] for update in updates],
+                                  source.stream['time_stamps'][ends])
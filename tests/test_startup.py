@@ -0,0 +1,20 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks.startup import HEAVY_MODULES, LIGHT_MODULES
+
+
+@pytest.mark.parametrize('module', LIGHT_MODULES + ['benchmarks.startup'])
+def test_light_modules_skip_heavy_imports(module):
+    """The light modules do not import mne, matplotlib or pyxdf."""
+    code = (f'import sys, {module}; '
+            f'print(*sorted(set(sys.modules) & {set(HEAVY_MODULES)!r}))')
+    result = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True,
+                            text=True,
+                            check=True,
+                            cwd=Path(__file__).parents[1] / 'src')
+    assert result.stdout.split() == []